@@ -1,17 +1,27 @@
+import gain_schedule
 import logging
 import math
-import pid
 
 logger = logging.getLogger('compass_yaw_controller')
 
 YAW_RANGE = 100
 
+PID_GAINS = dict(kp=100.0, ki=0.0, kd=0.0, integ_max=100.0,
+                 out_min=-YAW_RANGE, out_max=YAW_RANGE)
+
 class CompassYawController(object):
-  def __init__(self, cfmonitor):
+  # gain_table (see gain_schedule) may be scheduled on 'thrust' and
+  # 'heading_error' (radians)
+  def __init__(self, cfmonitor, gains=None, create_windows=True,
+               gain_table=None):
     self._cfmonitor = cfmonitor
-    self._pid = pid.PID(kp=100.0, ki=0.0, kd=0.0, integ_max=100.0,
-                        out_min=-YAW_RANGE, out_max=YAW_RANGE)
-    self._pid.CreateWindow('yaw')
+    gains = gains or {}
+    self._heading_error = 0.0
+    self._pid = gain_schedule.CreatePID(
+        gain_table, self._OperatingPoint,
+        **dict(PID_GAINS, **gains.get('yaw', {})))
+    if create_windows:
+      self.CreateWindows()
     self._target_x = None
     self._target_y = None
     self._min_x = self._target_x
@@ -27,6 +37,13 @@ class CompassYawController(object):
     self._min_bpz = None
     self._max_bpz = None
 
+  def CreateWindows(self):
+    self._pid.CreateWindow('yaw')
+
+  def _OperatingPoint(self):
+    return {'thrust': self._cfmonitor.GetThrust(),
+            'heading_error': self._heading_error}
+
   def SetAuto(self, auto):
     self._auto = auto
 
@@ -164,6 +181,7 @@ class CompassYawController(object):
       input_angle += 2 * math.pi
 
     if self._auto and thrust > 0:
+      self._heading_error = input_angle
       yaw = self._pid.Update(input_angle)
       logger.info(
           'raw_x: %f  raw_y: %f  x: %f  y: %f  target_x: %f  target_y: %f',
@@ -194,7 +212,7 @@ if __name__ == '__main__':
       format='%(asctime)s %(levelname).1s %(module)-12.12s %(message)s')
 
   test_cf = TestCf()
-  cy = CompassYawController(test_cf)
+  cy = CompassYawController(test_cf, create_windows=False)
   cy.SetAuto(True)
   test_cf.x = 100
   test_cf.y = 0
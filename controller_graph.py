@@ -0,0 +1,313 @@
+import collections
+import json
+import logging
+import sys
+import threading
+import time
+import virtual_link
+
+logger = logging.getLogger('controller_graph')
+
+# Equivalent to the setup monitor.py used to hard-code.  Each controller
+# entry has a 'type' (see ControllerGraph._BUILDERS) and optionally:
+#   link     index into 'links' the controller drives (default 0)
+#   rate     step rate in Hz (default: the loop rate)
+#   enabled  False to construct nothing for this entry
+#   gains    PID overrides keyed by PID name, e.g. {'x': {'kp': 0.4}}
+#   source   input source: joystick 'evdev', 'pygame' or a recording path;
+#            video camera index or clip path
+#   detector video and multi_camera: 'canny' or 'background', with
+#            keyword arguments in 'detector_options' (see quad_detector)
+#   calibration  multi_camera only: JSON camera list (see
+#            multi_camera.LoadCalibration); 'target' is an optional
+#            (x, y, z) to hold, otherwise the position when auto starts;
+#            'up_axis' is the world axis pointing up ('z', '-y', ...)
+#   predict  video and multi_camera: True to extrapolate positions over
+#            the capture latency (see position_predictor)
+#   capture_latency  video and multi_camera: frame age in seconds when
+#            grab() returns, default one frame period (see
+#            frame_pool.CaptureLatency); calibration entries may set
+#            their own per camera
+#   gain_table  pressure_thrust and compass_yaw: path of a gain schedule
+#            (see gain_schedule), tuning window can load replacements
+#   process  name of a worker process to run the controller in, e.g.
+#            'vision'; entries with the same name share one process (see
+#            process_workers).  Not for joysticks, and worker controllers
+#            have no tuning windows.
+# A top level 'worker_timeout' (seconds, default 0.5) sets how stale a
+# worker may get before the thrust of its links is cut in auto mode.
+# A top level 'telemetry' dict, e.g. {'address': 'localhost:5555'}, starts
+# a telemetry_server.TelemetryServer publishing each link's log data and
+# setpoints.
+# Links with a virtual:// URI (see virtual_link) need no radio or cflib.
+DEFAULT_CONFIG = {
+    'rate': 60.0,
+    'links': [
+        {'uri': 'radio://0/10/1M'},
+    ],
+    'controllers': [
+        {'type': 'joystick', 'source': 'evdev'},
+        {'type': 'video', 'source': 1},
+        {'type': 'pressure_thrust', 'enabled': False},
+        {'type': 'compass_yaw'},
+    ],
+}
+
+def LoadConfig(path):
+  with open(path) as f:
+    return json.load(f)
+
+
+class _Node(object):
+  def __init__(self, name, controller, period):
+    self.name = name
+    self.controller = controller
+    self.period = period
+    self.next_step = 0.0
+
+
+class ControllerGraph(object):
+  """Builds the links and controllers named in a config and steps them.
+
+  Subsystems (Qt, OpenCV, pygame, cflib) are only imported by the
+  builders that need them, and controllers are constructed in parallel so
+  slow hardware (camera open) overlaps.  Links and joysticks step as soon
+  as Start() returns; other controllers join the graph when built.  A controller whose
+  hardware is missing is logged and left out instead of aborting startup.
+  """
+  def __init__(self, config, headless=False):
+    self._start_time = time.time()
+    self._config = config
+    self._headless = headless or config.get('headless', False)
+    self._period = 1.0 / config.get('rate', 60.0)
+
+    self._app = None
+    self._window = None
+    self._cfmonitors = []
+    self._nodes = []
+    self._slots = []           # one per enabled spec, None until built
+    self._built = []           # built off the main thread, not yet added
+    self._lock = threading.Lock()
+    self._builders = []
+    self._workers = []
+    self._joystick = None
+    self._telemetry = None
+    self._first_setpoint_time = None
+
+  def Start(self):
+    import monitor
+    links = self._config.get('links', [])
+    specs = [spec for spec in self._config.get('controllers', [])
+             if spec.get('enabled', True)]
+    nodes = self._slots = [None] * len(specs)
+
+    # workers fork before any thread, Qt or radio exists
+    groups = collections.OrderedDict()
+    local = []
+    for i, spec in enumerate(specs):
+      if spec.get('process') and spec['type'] != 'joystick':
+        groups.setdefault(spec['process'], []).append((i, spec))
+      else:
+        local.append(i)
+    if groups:
+      import process_workers
+    for name, members in groups.items():
+      worker = process_workers.WorkerProcess(
+          name, [spec for _, spec in members], self._BuildNode, len(links),
+          self._period, self._config.get('worker_timeout', 0.5))
+      worker.Start()
+      self._workers.append(worker)
+      nodes[members[0][0]] = _Node('%s worker' % name, worker, 0.0)
+
+    if not self._headless:
+      from PyQt4 import QtGui
+      import monitor_window
+      self._app = QtGui.QApplication(sys.argv)
+      self._window = monitor_window.CfMonitorWindow(len(links))
+
+    if [link for link in links
+        if not virtual_link.IsVirtualUri(link['uri'])]:
+      import cflib.crtp as crtp
+      crtp.init_drivers()
+    if 'telemetry' in self._config:
+      import telemetry_server
+      self._telemetry = telemetry_server.TelemetryServer(
+          **self._config['telemetry'])
+      self._telemetry.Start()
+    for i, link in enumerate(links):
+      self._cfmonitors.append(monitor.CfMonitor(i, link['uri'], self._window,
+                                                self._telemetry))
+    for worker in self._workers:
+      worker.SetCfMonitors(self._cfmonitors)
+
+    def Build(i, spec):
+      try:
+        node = self._BuildNode(spec, self._cfmonitors[spec.get('link', 0)])
+      except Exception:
+        logger.exception('Failed to start %s controller, skipping',
+                         spec['type'])
+        return
+      with self._lock:
+        self._built.append((i, node))
+
+    # SDL (pygame joysticks) wants its event pump on the thread that
+    # initialized it, so joysticks are built here.  Everything else
+    # builds in the background; links and the joystick start stepping
+    # right away and slow controllers (camera open) join as they finish.
+    for i in local:
+      if specs[i]['type'] == 'joystick':
+        Build(i, specs[i])
+    self._builders = [threading.Thread(target=Build, args=(i, specs[i]))
+                      for i in local if specs[i]['type'] != 'joystick']
+    for thread in self._builders:
+      thread.start()
+    self._nodes = [node for node in nodes if node is not None]
+    self._AddBuiltNodes()
+
+  def _AddBuiltNodes(self):
+    """Adds controllers finished by the builder threads, on the main
+    thread since Qt widgets have to be created there."""
+    with self._lock:
+      built, self._built = self._built, []
+    if not built:
+      return
+    for i, node in built:
+      if not self._headless and hasattr(node.controller, 'CreateWindows'):
+        node.controller.CreateWindows()
+      self._slots[i] = node
+    self._nodes = [node for node in self._slots if node is not None]
+    logger.info('Started %s after %.3fs',
+                ', '.join(node.name for _, node in built),
+                time.time() - self._start_time)
+
+  def _BuildNode(self, spec, cfmonitor):
+    builder = getattr(self, self._BUILDERS[spec['type']])
+    controller = builder(spec, cfmonitor)
+    period = 1.0 / spec['rate'] if 'rate' in spec else 0.0
+    return _Node(spec['type'], controller, period)
+
+  def _BuildJoystick(self, spec, cfmonitor):
+    import joystick_controller
+    import joystick_input
+    source = spec.get('source', 'evdev')
+    if source == 'evdev':
+      input_device = joystick_input.OpenDefault()
+    elif source == 'pygame':
+      input_device = None
+    else:
+      input_device = joystick_input.ReplayJoystickInput(
+          joystick_input.ReadRecording(source))
+      input_device.Start()
+    controller = joystick_controller.JoystickController(
+        cfmonitor, self._OnSetButton, input_device)
+    self._joystick = controller
+    return controller
+
+  def _BuildVideo(self, spec, cfmonitor):
+    import quad_detector
+    import video_pid_controller
+    return video_pid_controller.VideoPIDController(
+        cfmonitor, camera_index=spec.get('source', 1),
+        gains=spec.get('gains'), display=not self._headless,
+        create_windows=False,
+        detector=quad_detector.CreateDetector(
+            spec.get('detector', 'canny'),
+            **spec.get('detector_options', {})),
+        predict=spec.get('predict', False),
+        capture_latency=spec.get('capture_latency'))
+
+  def _BuildMultiCamera(self, spec, cfmonitor):
+    import multi_camera
+    import multi_camera_controller
+    return multi_camera_controller.MultiCameraPIDController(
+        cfmonitor, multi_camera.LoadCalibration(spec['calibration']),
+        target=spec.get('target'), gains=spec.get('gains'),
+        display=not self._headless, create_windows=False,
+        detector=spec.get('detector', 'canny'),
+        detector_options=spec.get('detector_options'),
+        predict=spec.get('predict', False),
+        up_axis=spec.get('up_axis', 'z'),
+        capture_latency=spec.get('capture_latency'))
+
+  def _BuildPressureThrust(self, spec, cfmonitor):
+    import pressure_thrust_controller
+    return pressure_thrust_controller.PressureThrustController(
+        cfmonitor, gains=spec.get('gains'), create_windows=False,
+        gain_table=spec.get('gain_table'))
+
+  def _BuildCompassYaw(self, spec, cfmonitor):
+    import compass_yaw_controller
+    return compass_yaw_controller.CompassYawController(
+        cfmonitor, gains=spec.get('gains'), create_windows=False,
+        gain_table=spec.get('gain_table'))
+
+  _BUILDERS = {
+      'joystick': '_BuildJoystick',
+      'video': '_BuildVideo',
+      'multi_camera': '_BuildMultiCamera',
+      'pressure_thrust': '_BuildPressureThrust',
+      'compass_yaw': '_BuildCompassYaw',
+  }
+
+  def _OnSetButton(self):
+    for node in self._nodes:
+      if hasattr(node.controller, 'SetTarget'):
+        node.controller.SetTarget()
+
+  def Step(self):
+    self._AddBuiltNodes()
+    now = time.time()
+    auto = self._joystick.GetAuto() if self._joystick is not None else False
+    for cfmonitor in self._cfmonitors:
+      cfmonitor.SetAuto(auto)
+    for node in self._nodes:
+      if hasattr(node.controller, 'SetAuto'):
+        node.controller.SetAuto(auto)
+      if now >= node.next_step:
+        node.controller.Step()
+        node.next_step = now + node.period
+    for cfmonitor in self._cfmonitors:
+      cfmonitor.UpdateCommander()
+
+    if self._first_setpoint_time is None and self._cfmonitors:
+      self._first_setpoint_time = time.time()
+      logger.info('First setpoint %.3fs after start',
+                  self.GetTimeToFirstSetpoint())
+
+  def GetTimeToFirstSetpoint(self):
+    if self._first_setpoint_time is None:
+      return None
+    return self._first_setpoint_time - self._start_time
+
+  def Run(self):
+    next_tick = time.time()
+    while True:
+      now = time.time()
+      if now >= next_tick:
+        self.Step()
+        next_tick = max(next_tick + self._period, now)
+      elif self._joystick is not None:
+        # woken early by input: pick up buttons and sticks now, the
+        # commander still only sends once per period
+        self._joystick.Step()
+      # controllers only pump OpenCV windows, and only when they show a
+      # frame; the monitor table and tuning windows need Qt serviced here
+      if self._app is not None:
+        self._app.processEvents()
+      timeout = max(0.0, next_tick - time.time())
+      if self._joystick is not None:
+        self._joystick.WaitForInput(timeout)
+      else:
+        time.sleep(timeout)
+
+  def Shutdown(self):
+    for thread in self._builders:
+      thread.join()
+    self._AddBuiltNodes()
+    for node in self._nodes:
+      if hasattr(node.controller, 'Shutdown'):
+        node.controller.Shutdown()
+    for cfmonitor in self._cfmonitors:
+      cfmonitor.Shutdown()
+    if self._telemetry is not None:
+      self._telemetry.Stop()
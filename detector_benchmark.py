@@ -0,0 +1,68 @@
+import argparse
+import cv2
+import logging
+import math
+import quad_detector
+import time
+
+logger = logging.getLogger('detector_benchmark')
+
+def Benchmark(detector, path, max_frames=None):
+  """Runs detector over every frame of a recorded clip.
+
+  Returns a dict with per-frame timing, detection rate and jitter (mean
+  distance between a position and the midpoint of its neighbours, which
+  is small for a smooth track and large for a noisy one).
+  """
+  capture = cv2.VideoCapture(path)
+  detector.Reset()
+  times = []
+  positions = []
+  while max_frames is None or len(times) < max_frames:
+    result, im = capture.read()
+    if not result:
+      break
+    start = time.time()
+    positions.append(detector.Detect(im))
+    times.append(time.time() - start)
+  capture.release()
+
+  jitter = []
+  for prev, cur, next in zip(positions, positions[1:], positions[2:]):
+    if prev is None or cur is None or next is None:
+      continue
+    jitter.append(math.hypot(cur[0] - (prev[0] + next[0]) / 2.0,
+                             cur[1] - (prev[1] + next[1]) / 2.0))
+
+  times.sort()
+  frames = len(times)
+  return {
+      'frames': frames,
+      'mean_ms': 1000.0 * sum(times) / max(1, frames),
+      'p95_ms': 1000.0 * times[int(0.95 * (frames - 1))] if frames else 0.0,
+      'detected': sum(1 for p in positions if p is not None),
+      'jitter': sum(jitter) / len(jitter) if jitter else float('nan'),
+  }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Compare quad detectors on recorded clips')
+  parser.add_argument('clips', nargs='+')
+  parser.add_argument('--detectors', default='canny,background',
+                      help='comma separated names from quad_detector')
+  parser.add_argument('--max-frames', type=int)
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.INFO)
+
+  print '%-24s %-12s %7s %8s %8s %9s %7s' % (
+      'clip', 'detector', 'frames', 'mean ms', 'p95 ms', 'detected',
+      'jitter')
+  for path in args.clips:
+    for name in args.detectors.split(','):
+      result = Benchmark(quad_detector.CreateDetector(name), path,
+                         args.max_frames)
+      print '%-24.24s %-12s %7d %8.2f %8.2f %8.0f%% %7.2f' % (
+          path, name, result['frames'], result['mean_ms'], result['p95_ms'],
+          100.0 * result['detected'] / max(1, result['frames']),
+          result['jitter'])
@@ -0,0 +1,58 @@
+import logging
+import numpy
+
+logger = logging.getLogger('frame_pool')
+
+def CaptureLatency(capture, capture_latency=None):
+  """Seconds between exposure and grab() returning for capture.
+
+  grab() hands back a frame that has already been exposed, buffered and
+  transferred, so a timestamp taken after it is late by about this much.
+  Defaults to one frame period when the driver reports its frame rate.
+  """
+  if capture_latency is not None:
+    return capture_latency
+  fps = capture.get(5)  # CAP_PROP_FPS
+  return 1.0 / fps if fps > 0 else 0.0
+
+
+class FramePool(object):
+  """Ring of frame buffers reused across captures.
+
+  Buffers are allocated by the first size retrieves and then handed back
+  to cv2.VideoCapture.retrieve() to be filled in place, so steady state
+  capture allocates nothing.  A frame stays valid until size - 1 more
+  frames have been retrieved.
+  """
+  def __init__(self, size=3):
+    self._buffers = [None] * size
+    self._index = 0
+
+  def Retrieve(self, capture):
+    buf = self._buffers[self._index]
+    result, im = capture.retrieve(buf)
+    if im is not None:
+      if buf is not None and im is not buf:
+        logger.debug('frame format changed, reallocated buffer')
+      self._buffers[self._index] = im
+    self._index = (self._index + 1) % len(self._buffers)
+    return result, im
+
+
+class Scratch(object):
+  """Named work buffers that are reallocated only when the shape changes."""
+  def __init__(self):
+    self._buffers = {}
+
+  def Get(self, name, shape, dtype=numpy.uint8):
+    buf = self._buffers.get(name)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+      buf = numpy.empty(shape, dtype)
+      self._buffers[name] = buf
+    return buf
+
+  def Canvas(self, name, im):
+    """Copy of im to draw on, leaving im itself untouched."""
+    canvas = self.Get(name, im.shape, im.dtype)
+    numpy.copyto(canvas, im)
+    return canvas
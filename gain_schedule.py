@@ -0,0 +1,194 @@
+import csv
+import json
+import logging
+import pid
+
+logger = logging.getLogger('gain_schedule')
+
+class GainTable(object):
+  """(kp, ki, kd) on a regular grid over named operating point axes.
+
+  axes is a list of (name, start, step, count).  gains holds one
+  [kp, ki, kd] per grid point, nested in axis order.  Lookup interpolates
+  linearly between the 2^n surrounding grid points (clamped at the edges),
+  so its cost depends only on the number of axes, not the table size.
+  """
+  def __init__(self, axes, gains):
+    self.axes = [(str(name), float(start), float(step), int(count))
+                 for name, start, step, count in axes]
+    self.names = [axis[0] for axis in self.axes]
+    self.gains = gains
+    # flatten for constant time indexing
+    self._flat = []
+    self._strides = []
+    stride = 1
+    for _, _, _, count in reversed(self.axes):
+      self._strides.insert(0, stride)
+      stride *= count
+    def Flatten(values, depth):
+      if depth == len(self.axes):
+        self._flat.append(tuple(float(v) for v in values))
+      else:
+        for v in values:
+          Flatten(v, depth + 1)
+    Flatten(gains, 0)
+    if len(self._flat) != stride:
+      raise ValueError('gain table has %d entries, axes need %d' %
+                       (len(self._flat), stride))
+
+  def Lookup(self, point):
+    """Returns interpolated (kp, ki, kd) at point, given in axis order."""
+    corners = [(0, 1.0)]
+    for (_, start, step, count), stride, value in zip(
+        self.axes, self._strides, point):
+      f = (value - start) / step if count > 1 else 0.0
+      f = min(max(f, 0.0), count - 1.0)
+      i = min(int(f), count - 2) if count > 1 else 0
+      frac = f - i
+      next_corners = []
+      for offset, weight in corners:
+        next_corners.append((offset + i * stride, weight * (1.0 - frac)))
+        if frac > 0.0:
+          next_corners.append((offset + (i + 1) * stride, weight * frac))
+      corners = next_corners
+    kp = ki = kd = 0.0
+    for offset, weight in corners:
+      gains = self._flat[offset]
+      kp += gains[0] * weight
+      ki += gains[1] * weight
+      kd += gains[2] * weight
+    return kp, ki, kd
+
+  def Save(self, path):
+    with open(path, 'w') as f:
+      json.dump({'axes': self.axes, 'gains': self.gains}, f, indent=1)
+
+  @classmethod
+  def Load(cls, path):
+    with open(path) as f:
+      table = json.load(f)
+    return cls(table['axes'], table['gains'])
+
+  @classmethod
+  def FromRows(cls, axes, rows):
+    """Builds a table from (point..., kp, ki, kd) rows, e.g. the results
+    of offline tuning runs.  Every grid point needs a row."""
+    def Empty(depth):
+      if depth == len(axes):
+        return None
+      return [Empty(depth + 1) for _ in xrange(int(axes[depth][3]))]
+    gains = Empty(0)
+    for row in rows:
+      point, values = row[:len(axes)], row[len(axes):]
+      cell = gains
+      for depth, ((_, start, step, count), value) in enumerate(
+          zip(axes, point)):
+        index = int(round((float(value) - start) / step)) if count > 1 else 0
+        if not 0 <= index < count:
+          raise ValueError('%s outside the table' % (point,))
+        if depth == len(axes) - 1:
+          cell[index] = [float(v) for v in values]
+        else:
+          cell = cell[index]
+    def CheckFilled(cell, point):
+      if cell is None:
+        raise ValueError('no gains for grid point %s' % (tuple(point),))
+      if len(point) < len(axes):
+        _, start, step, _ = axes[len(point)]
+        for i, child in enumerate(cell):
+          CheckFilled(child, point + [start + i * step])
+    CheckFilled(gains, [])
+    return cls(axes, gains)
+
+
+class ScheduledPID(pid.PID):
+  """PID whose gains are looked up from a GainTable before each update.
+
+  operating_point is called on every update and returns a dict mapping
+  axis names to their current values (missing axes read 0).  The table
+  can be replaced at any time with SetTable(); Update() reads the
+  reference once, so it always uses one whole table.
+  """
+  def __init__(self, table, operating_point, **kwargs):
+    pid.PID.__init__(self, **kwargs)
+    self._table = table
+    self._operating_point = operating_point
+
+  def SetTable(self, table):
+    self._table = table
+
+  def GetTable(self):
+    return self._table
+
+  def Update(self, measured):
+    table = self._table
+    point = self._operating_point()
+    self.SetGains(*table.Lookup([point.get(name, 0.0)
+                                 for name in table.names]))
+    return pid.PID.Update(self, measured)
+
+  def CreateWindow(self, name):
+    from PyQt4 import QtCore, QtGui
+    pid.PID.CreateWindow(self, name)
+    # the table overrides hand edits on every update, so the gain fields
+    # only show what it looked up last
+    for edit in self._gain_edits:
+      edit.textChanged.disconnect()
+      edit.setReadOnly(True)
+      edit.setToolTip('Scheduled from the gain table')
+    def ShowGains():
+      for edit, gain in zip(self._gain_edits,
+                            (self._kp, self._ki, self._kd)):
+        edit.setText('%f' % gain)
+    timer = QtCore.QTimer(self._window)
+    timer.timeout.connect(ShowGains)
+    timer.start(200)
+    grid = self._window.layout()
+    row = grid.rowCount()
+    grid.addWidget(QtGui.QLabel('Table', self._window), row, 0)
+    edit = QtGui.QLineEdit(self._window)
+    grid.addWidget(edit, row, 1)
+    button = QtGui.QPushButton('Load', self._window)
+    def LoadTable():
+      path = str(edit.text())
+      try:
+        self.SetTable(GainTable.Load(path))
+        logger.info('%s: loaded gain table %s', name, path)
+      except (IOError, ValueError, KeyError) as e:
+        logger.error('%s: cannot load gain table %s: %s', name, path, e)
+    button.clicked.connect(LoadTable)
+    grid.addWidget(button, row, 2)
+
+
+def CreatePID(gain_table, operating_point, **kwargs):
+  """A ScheduledPID if gain_table (a GainTable or a path) is given,
+  otherwise a plain PID."""
+  if gain_table is None:
+    return pid.PID(**kwargs)
+  if not isinstance(gain_table, GainTable):
+    gain_table = GainTable.Load(gain_table)
+  return ScheduledPID(gain_table, operating_point, **kwargs)
+
+
+if __name__ == '__main__':
+  # convert offline tuning results (CSV rows: point values, kp, ki, kd)
+  # into a table, e.g.
+  #   gain_schedule.py tuning.csv thrust.json --axis thrust:30000:2000:8
+  import argparse
+  parser = argparse.ArgumentParser()
+  parser.add_argument('results')
+  parser.add_argument('table')
+  parser.add_argument('--axis', action='append', required=True,
+                      help='name:start:step:count, in CSV column order')
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.INFO)
+
+  axes = []
+  for spec in args.axis:
+    name, start, step, count = spec.split(':')
+    axes.append((name, float(start), float(step), int(count)))
+  with open(args.results) as f:
+    rows = [row for row in csv.reader(f)
+            if row and not row[0].startswith('#')]
+  GainTable.FromRows(axes, rows).Save(args.table)
+  logger.info('wrote %s', args.table)
@@ -1,24 +1,30 @@
-import joystick
+import joystick_input
 import logging
-import pygame
 import sys
+import time
 
 logger = logging.getLogger('joystick_controller')
 
 class JoystickController(object):
-  def __init__(self, cfmonitor, set_button_callback):
+  def __init__(self, cfmonitor, set_button_callback, input_device=None):
     self._cfmonitor = cfmonitor
-    pygame.display.init()
-    pygame.joystick.init()
-    if pygame.joystick.get_count() > 0:
-      if (sys.platform == 'win32'):
-        self._joystick = joystick.Xbox360ControllerWindowsJoystick(0)
-      elif (sys.platform == 'linux2'):
-        self._joystick = joystick.Xbox360ControllerLinuxJoystick(0)
-      else:
-        raise Exception('Platform for joystick is not supported');
-    else:
-      self._joystick = None
+    # event-driven input (see joystick_input); None falls back to polling
+    # the joystick through pygame on every Step
+    self._input = input_device
+    self._joystick = None
+    if self._input is None:
+      # pygame is only needed (and only imported) for the polling fallback
+      import joystick
+      import pygame
+      pygame.display.init()
+      pygame.joystick.init()
+      if pygame.joystick.get_count() > 0:
+        if (sys.platform == 'win32'):
+          self._joystick = joystick.Xbox360ControllerWindowsJoystick(0)
+        elif (sys.platform == 'linux2'):
+          self._joystick = joystick.Xbox360ControllerLinuxJoystick(0)
+        else:
+          raise Exception('Platform for joystick is not supported');
 
     self._roll_range = 20.0
     self._pitch_range = 20.0
@@ -30,35 +36,74 @@ class JoystickController(object):
     self._auto = False
     self._set_button_callback = set_button_callback
 
+  def _OnButton(self, button):
+    if button == joystick_input.THRUST_MAX:
+      self._thrust_max += 500
+      logger.info('trim thrust_max to %d', self._thrust_max)
+    elif button == joystick_input.THRUST_MIN:
+      self._thrust_max -= 500
+      logger.info('trim thrust_max to %d', self._thrust_max)
+    elif button == joystick_input.SWITCH:
+      self._auto = not self._auto
+    elif button == joystick_input.SET:
+      self._set_button_callback()
+
+  def _SetOutputs(self, roll, pitch, yaw, thrust):
+    self._cfmonitor.SetRoll(roll * self._roll_range)
+    self._cfmonitor.SetPitch(pitch * self._pitch_range)
+    self._cfmonitor.SetYaw(yaw * self._yaw_range)
+    self._cfmonitor.SetThrust(int(thrust * self._thrust_max))
+
   def Step(self):
+    if self._input is not None:
+      self._StepInput()
+    else:
+      self._StepPygame()
+
+  def _StepPygame(self):
+    import pygame
     for event in pygame.event.get():
       if event.type == pygame.JOYBUTTONDOWN:
         if event.button == self._joystick.getIncreaseMaxThrustButton():
-          self._thrust_max += 500
-          logger.info('trim thrust_max to %d', self._thrust_max)
+          self._OnButton(joystick_input.THRUST_MAX)
         elif event.button == self._joystick.getDecreaseMaxThrustButton():
-          self._thrust_max -= 500
-          logger.info('trim thrust_max to %d', self._thrust_max)
+          self._OnButton(joystick_input.THRUST_MIN)
         elif event.button == self._joystick.getSwitchButton():
-          self._auto = not self._auto
+          self._OnButton(joystick_input.SWITCH)
         elif event.button == self._joystick.getSetButton():
-          self._set_button_callback()
+          self._OnButton(joystick_input.SET)
         
     if self._joystick is not None:
-      roll = self._joystick.getRoll() * self._roll_range
-      pitch = self._joystick.getPitch() * self._pitch_range
-      yaw = self._joystick.getYaw() * self._yaw_range
-      thrust = self._joystick.getThrust() * self._thrust_max
-      self._cfmonitor.SetRoll(roll)
-      self._cfmonitor.SetPitch(pitch)
-      self._cfmonitor.SetYaw(yaw)
-      self._cfmonitor.SetThrust(int(thrust))
+      self._SetOutputs(self._joystick.getRoll(),
+                       self._joystick.getPitch(),
+                       self._joystick.getYaw(),
+                       self._joystick.getThrust())
+
+  def _StepInput(self):
+    # nothing moved since the last step, the commanded values still hold
+    if not self._input.HasChanged():
+      return
+    axes, buttons = self._input.GetState()
+    for button in buttons:
+      self._OnButton(button)
+    # always reapply after a button press so leaving auto mode takes back
+    # control from the automatic controllers even if the sticks are idle
+    self._SetOutputs(axes[joystick_input.ROLL],
+                     axes[joystick_input.PITCH],
+                     axes[joystick_input.YAW],
+                     axes[joystick_input.THRUST])
+
+  def WaitForInput(self, timeout):
+    """Sleeps up to timeout seconds, returning early on joystick input."""
+    if self._input is not None:
+      self._input.Wait(timeout)
+    else:
+      time.sleep(timeout)
 
   def GetAuto(self):
     return self._auto
 
 if __name__ == '__main__':
-  import time
   class TestCf(object):
     def SetRoll(self, roll):
       print 'Roll: ' + str(roll)
@@ -72,8 +117,11 @@ if __name__ == '__main__':
     def SetThrust(self, thrust):
       print 'Thrust: ' + str(thrust)
     
-  js = JoystickController(TestCf())
+  def SetButtonPressed():
+    print 'Set'
+  js = JoystickController(TestCf(), SetButtonPressed,
+                          joystick_input.OpenDefault())
   while True:
+    js.WaitForInput(0.5)
     js.Step()
-    time.sleep(0.5)
     
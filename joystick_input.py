@@ -0,0 +1,293 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger('joystick_input')
+
+# logical axes, all normalized so that centered sticks read 0.0
+ROLL = 'roll'        # right = 1, left = -1
+PITCH = 'pitch'      # up = 1, down = -1
+YAW = 'yaw'          # right = 1, left = -1
+THRUST = 'thrust'    # 0 (not pressed) to 1 (pressed)
+AXES = (ROLL, PITCH, YAW, THRUST)
+
+# logical buttons
+THRUST_MAX = 'thrust_max'
+THRUST_MIN = 'thrust_min'
+SWITCH = 'switch'
+SET = 'set'
+
+class JoystickInput(object):
+  """Joystick state kept up to date by a dedicated reader thread.
+
+  Subclasses implement _Run(), which blocks on the device and reports
+  changes through _SetAxis() and _PressButton().  The control loop calls
+  Wait() to sleep until something changes instead of polling every tick.
+
+  smoothing low-pass filters axis events.  Devices stop sending events
+  once a stick settles, so an axis snaps to its last raw value when no
+  event arrived for settle_time seconds.
+  """
+  def __init__(self, deadzone=0.05, smoothing=0.0, settle_time=0.05):
+    self._deadzone = deadzone
+    self._smoothing = smoothing  # 0 = no filtering, close to 1 = heavy
+    self._settle_time = settle_time
+
+    self._cond = threading.Condition()
+    self._axes = dict((axis, 0.0) for axis in AXES)
+    self._targets = dict(self._axes)
+    self._last_event = 0.0
+    self._buttons = []
+    self._version = 0
+    self._seen_version = 0
+
+    self._running = False
+    self._thread = None
+    self._record_file = None
+    self._record_start = None
+
+  def Start(self):
+    self._running = True
+    self._thread = threading.Thread(target=self._RunLoop,
+                                    name=self.__class__.__name__)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def Stop(self):
+    self._running = False
+    with self._cond:
+      self._cond.notify_all()
+      if self._record_file is not None:
+        self._record_file.close()
+        self._record_file = None
+
+  def Record(self, path):
+    """Writes every raw event to path for later ReplayJoystickInput use."""
+    with self._cond:
+      self._record_file = open(path, 'w')
+      self._record_start = time.time()
+
+  def _WriteRecord(self, kind, name, value):
+    # caller holds _cond
+    if self._record_file is None:
+      return
+    self._record_file.write('%.4f %s %s %f\n' %
+                            (time.time() - self._record_start,
+                             kind, name, value))
+
+  def _RunLoop(self):
+    try:
+      self._Run()
+    except Exception:
+      logger.exception('Joystick reader stopped')
+
+  def _Run(self):
+    raise NotImplementedError("Should have implemented _Run")
+
+  def _ApplyDeadzone(self, value):
+    if abs(value) <= self._deadzone:
+      return 0.0
+    # rescale so output still spans the full range outside the deadzone
+    scaled = (abs(value) - self._deadzone) / (1.0 - self._deadzone)
+    return scaled if value > 0 else -scaled
+
+  def _SetAxis(self, axis, value):
+    with self._cond:
+      self._WriteRecord('axis', axis, value)
+      value = self._ApplyDeadzone(value)
+      self._targets[axis] = value
+      self._last_event = time.time()
+      last = self._axes[axis]
+      value = last * self._smoothing + value * (1.0 - self._smoothing)
+      if abs(value) < 1e-4:
+        value = 0.0
+      if value == last:
+        return
+      self._axes[axis] = value
+      self._version += 1
+      self._cond.notify_all()
+
+  def _PressButton(self, button):
+    with self._cond:
+      self._WriteRecord('button', button, 0)
+      self._buttons.append(button)
+      self._version += 1
+      self._cond.notify_all()
+
+  def Wait(self, timeout=None):
+    """Block until the state changes or timeout expires.
+
+    Returns True if there is a change the caller has not seen yet.
+    """
+    with self._cond:
+      self._Settle()
+      if self._version == self._seen_version and self._running:
+        if self._axes != self._targets:
+          # wake up in time to settle the filter
+          settle_in = max(0.0, self._last_event + self._settle_time -
+                          time.time())
+          timeout = settle_in if timeout is None else min(timeout, settle_in)
+        self._cond.wait(timeout)
+        self._Settle()
+      return self._version != self._seen_version
+
+  def HasChanged(self):
+    with self._cond:
+      self._Settle()
+      return self._version != self._seen_version
+
+  def _Settle(self):
+    # caller holds _cond
+    if (self._axes != self._targets and
+        time.time() - self._last_event >= self._settle_time):
+      self._axes.update(self._targets)
+      self._version += 1
+      self._cond.notify_all()
+
+  def GetState(self):
+    """Returns (axes, buttons pressed since the last call) and marks the
+    current state as seen."""
+    with self._cond:
+      axes = dict(self._axes)
+      buttons = self._buttons
+      self._buttons = []
+      self._seen_version = self._version
+    return axes, buttons
+
+
+class EvdevJoystickInput(JoystickInput):
+  """Xbox 360 controller read through the Linux evdev interface."""
+  def __init__(self, device_path=None, **kwargs):
+    JoystickInput.__init__(self, **kwargs)
+    import evdev
+    self._ecodes = evdev.ecodes
+    if device_path is None:
+      device_path = _FindEvdevJoystick(evdev)
+    self._device = evdev.InputDevice(device_path)
+    logger.info('Joystick %s (%s)', self._device.name, device_path)
+
+    ecodes = evdev.ecodes
+    # code -> (axis, sign)
+    self._axis_map = {
+        ecodes.ABS_X: (ROLL, 1.0),    # Left stick right/left
+        ecodes.ABS_Y: (PITCH, -1.0),  # Left stick up/down
+        ecodes.ABS_RX: (YAW, 1.0),    # Right stick right/left
+        ecodes.ABS_RZ: (THRUST, 1.0), # Right trigger
+    }
+    self._button_map = {
+        ecodes.BTN_Y: THRUST_MAX,
+        ecodes.BTN_A: THRUST_MIN,
+        ecodes.BTN_B: SWITCH,
+        ecodes.BTN_X: SET,
+    }
+    self._ranges = {}
+    for code, info in self._device.capabilities().get(ecodes.EV_ABS, []):
+      self._ranges[code] = (info.min, info.max)
+
+  def _Normalize(self, code, value):
+    lo, hi = self._ranges.get(code, (-32768, 32767))
+    if self._axis_map[code][0] == THRUST:
+      return float(value - lo) / (hi - lo)
+    return (float(value - lo) / (hi - lo)) * 2.0 - 1.0
+
+  def _Run(self):
+    ecodes = self._ecodes
+    for event in self._device.read_loop():
+      if not self._running:
+        break
+      if event.type == ecodes.EV_ABS and event.code in self._axis_map:
+        axis, sign = self._axis_map[event.code]
+        self._SetAxis(axis, sign * self._Normalize(event.code, event.value))
+      elif (event.type == ecodes.EV_KEY and event.value == 1 and
+            event.code in self._button_map):
+        self._PressButton(self._button_map[event.code])
+
+
+def _FindEvdevJoystick(evdev):
+  for path in evdev.list_devices():
+    device = evdev.InputDevice(path)
+    abs_codes = [c for c, _ in
+                 device.capabilities().get(evdev.ecodes.EV_ABS, [])]
+    if evdev.ecodes.ABS_X in abs_codes and evdev.ecodes.ABS_RZ in abs_codes:
+      return path
+  raise IOError('No evdev joystick found')
+
+
+class ReplayJoystickInput(JoystickInput):
+  """Plays back recorded events with their original timing.
+
+  Each event is a tuple (t, kind, name, value) where t is seconds since
+  the start of the recording, kind is 'axis' or 'button', name is one of
+  the logical axes or buttons, and value is the raw axis value (ignored
+  for buttons).
+  """
+  def __init__(self, events, speed=1.0, **kwargs):
+    JoystickInput.__init__(self, **kwargs)
+    self._events = sorted(events)
+    self._speed = speed
+
+  def _Run(self):
+    start = time.time()
+    for t, kind, name, value in self._events:
+      delay = start + t / self._speed - time.time()
+      if delay > 0:
+        time.sleep(delay)
+      if not self._running:
+        break
+      if kind == 'axis':
+        self._SetAxis(name, value)
+      elif kind == 'button':
+        self._PressButton(name)
+
+
+class SyntheticJoystickInput(JoystickInput):
+  """Input driven directly by the caller, for tests.  No thread needed."""
+  def Start(self):
+    self._running = True
+
+  def SetAxis(self, axis, value):
+    self._SetAxis(axis, value)
+
+  def PressButton(self, button):
+    self._PressButton(button)
+
+
+def ReadRecording(path):
+  """Reads 't kind name value' lines written by JoystickInput.Record()."""
+  events = []
+  with open(path) as f:
+    for line in f:
+      line = line.strip()
+      if not line or line.startswith('#'):
+        continue
+      t, kind, name, value = line.split()
+      events.append((float(t), kind, name, float(value)))
+  return events
+
+
+def OpenDefault(**kwargs):
+  """Returns a started evdev input if available, otherwise None so the
+  caller can fall back to pygame polling."""
+  try:
+    joystick_input = EvdevJoystickInput(**kwargs)
+  except (ImportError, IOError, OSError) as e:
+    logger.info('evdev joystick unavailable (%s)', e)
+    return None
+  joystick_input.Start()
+  return joystick_input
+
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.DEBUG)
+
+  events = [(0.0, 'axis', ROLL, 0.02),  # inside the deadzone
+            (0.1, 'axis', ROLL, 0.5),
+            (0.2, 'button', SWITCH, 0),
+            (0.3, 'axis', THRUST, 1.0)]
+  replay = ReplayJoystickInput(events)
+  replay.Start()
+  while True:
+    if not replay.Wait(1.0):
+      break
+    axes, buttons = replay.GetState()
+    logger.debug('axes=%s buttons=%s', axes, buttons)
@@ -14,6 +14,11 @@ class KalmanFilter(object):
     self._Q = Q  # estimated error in process
     self._R = R  # estimated error in measurement
 
+  def SetTransition(self, A, Q):
+    # for models whose transition depends on a varying time step
+    self._A = A
+    self._Q = Q
+
   def Step(self, control, measurement):
     # prediction step
     xe = self._A * self._x + self._B * control
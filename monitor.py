@@ -1,23 +1,9 @@
-import compass_yaw_controller
-import cv2
-import joystick_controller
+import argparse
 import logging
-import pressure_thrust_controller
-import sys
-import time
-import video_pid_controller
-
-from PyQt4 import QtCore
-from PyQt4 import QtGui
-
-import cfclient.utils.logconfigreader as logconfigreader
-import cflib.crazyflie as crazyflie
-import cflib.crtp as crtp
+import virtual_link
 
 logger = logging.getLogger('monitor')
 
-LINK_URIS = ['radio://0/10/1M']
-
 class Field(object):
   def __init__(self, label, width, var=None, vartype='float'):
     self.label = label
@@ -41,8 +27,10 @@ FIELDS = [
     Field('AUTO', 10)
 ]
 
+SETPOINT_FIELDS = ['roll', 'pitch', 'yaw', 'thrust', 'auto']
+
 class CfMonitor(object):
-  def __init__(self, index, link_uri, window):
+  def __init__(self, index, link_uri, window, telemetry=None):
     self._roll = 0.0
     self._pitch = 0.0
     self._yaw = 0.0
@@ -59,7 +47,23 @@ class CfMonitor(object):
     self._index = index
     self._link_uri = link_uri
     self._window = window
-    self._cf = crazyflie.Crazyflie()
+    # optional telemetry_server.TelemetryServer
+    self._telemetry = telemetry
+    if telemetry is not None:
+      self._log_vars = [f.var for f in FIELDS if f.var is not None]
+      self._log_topic = telemetry.AddTopic('cf%d/log' % index, self._log_vars)
+      self._setpoint_topic = telemetry.AddTopic('cf%d/setpoint' % index,
+                                                SETPOINT_FIELDS)
+    # cflib is imported on first use so a headless or partial setup does not
+    # pay for it at startup
+    if virtual_link.IsVirtualUri(link_uri):
+      self._logconfigreader = virtual_link
+      self._cf = virtual_link.VirtualCrazyflie()
+    else:
+      import cfclient.utils.logconfigreader as logconfigreader
+      import cflib.crazyflie as crazyflie
+      self._logconfigreader = logconfigreader
+      self._cf = crazyflie.Crazyflie()
     self._cf.connectSetupFinished.add_callback(self._onConnect)
     logger.info('Opening link to ' + link_uri)
     self._cf.open_link(link_uri)
@@ -70,6 +74,7 @@ class CfMonitor(object):
 
   def _onConnect(self, link_uri):
     logger.info('Connected to crazyflie ' + link_uri)
+    logconfigreader = self._logconfigreader
 
     logconf = logconfigreader.LogConfig('Logging', period=100)
     for f in [f for f in FIELDS if f.var is not None]:
@@ -89,6 +94,11 @@ class CfMonitor(object):
     self._acc_x = data['acc.x']
     self._acc_y = data['acc.y']
     self._acc_z = data['acc.z']
+    if self._telemetry is not None:
+      self._telemetry.Publish(self._log_topic,
+                              [data[var] for var in self._log_vars])
+    if self._window is None:
+      return
     for i, field in enumerate(FIELDS):
       if field.var is None:
         if field.label == 'URI':
@@ -99,6 +109,9 @@ class CfMonitor(object):
         s = str(data[field.var])
       self._window.SetTableItemText(self._index, i, s)
 
+  def SetAuto(self, auto):
+    self._auto = auto
+
   def GetPressure(self):
     return self._pressure
 
@@ -138,79 +151,36 @@ class CfMonitor(object):
   def UpdateCommander(self):
     self._cf.commander.send_setpoint(
         self._roll, self._pitch, self._yaw, self._thrust)
-
-
-class CfMonitorWindow(QtGui.QWidget):
-  def __init__(self):
-    super(CfMonitorWindow, self).__init__()
-    self.setWindowTitle('Crazyflie Monitor')
-
-    self._table = QtGui.QTableWidget(self)
-    self._table.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
-    self._table.setColumnCount(len(FIELDS))
-    self._table.setRowCount(len(LINK_URIS))
-    self._table.setHorizontalHeaderLabels([f.label for f in FIELDS])
-    for c, field in enumerate(FIELDS):
-      self._table.setColumnWidth(c, field.width * 10)
-    for r in xrange(self._table.rowCount()):
-      for c in xrange(self._table.columnCount()):
-        self._table.setItem(r, c, QtGui.QTableWidgetItem())
-
-    self._vbox = QtGui.QVBoxLayout()
-    self._vbox.addStretch(1)
-    self._vbox.addWidget(self._table)
-    self.setLayout(self._vbox)
-
-    self.setGeometry(100, 100, 600, 200)
-    self.show()
-
-  def SetTableItemText(self, row, col, text):
-    self._table.item(row, col).setText(text)
+    if self._telemetry is not None:
+      self._telemetry.Publish(
+          self._setpoint_topic,
+          [self._roll, self._pitch, self._yaw, self._thrust, self._auto])
 
 
 if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('config', nargs='?',
+                      help='controller graph config (JSON), see '
+                      'controller_graph.DEFAULT_CONFIG')
+  parser.add_argument('--headless', action='store_true',
+                      help='run without Qt or video windows')
+  args = parser.parse_args()
+
   logging.basicConfig(
       level=logging.INFO,
       format='%(asctime)s %(levelname).1s %(module)-12.12s %(message)s')
       #filename='log.txt')
-  
-  app = QtGui.QApplication(sys.argv)
-  window = CfMonitorWindow()
-
-  crtp.init_drivers()
-
-  cfmonitors = []
-  for i, uri in enumerate(LINK_URIS):
-    cfmonitors.append(CfMonitor(i, uri, window))
-
-  video_controller = video_pid_controller.VideoPIDController(cfmonitors[0])
-  pressure_thrust_controller = (
-      pressure_thrust_controller.PressureThrustController(cfmonitors[0]))
-  compass_yaw_controller = (
-      compass_yaw_controller.CompassYawController(cfmonitors[0]))
-
-  def SetButtonPressed():
-    compass_yaw_controller.SetTarget()
-  joy_controller = joystick_controller.JoystickController(cfmonitors[0],
-                                                          SetButtonPressed)
 
+  import controller_graph
+  if args.config:
+    config = controller_graph.LoadConfig(args.config)
+  else:
+    config = controller_graph.DEFAULT_CONFIG
+  graph = controller_graph.ControllerGraph(config, headless=args.headless)
   try:
-    while True:
-      auto = joy_controller.GetAuto()
-      cfmonitors[0]._auto = auto
-      video_controller.SetAuto(auto)
-      pressure_thrust_controller.SetAuto(auto)
-      compass_yaw_controller.SetAuto(auto)
-      joy_controller.Step()
-      video_controller.Step()
-      #pressure_thrust_controller.Step()
-      compass_yaw_controller.Step()
-      for cfmonitor in cfmonitors:
-        cfmonitor.UpdateCommander()
-      time.sleep(0.016)
-      cv2.waitKey(1)
+    graph.Start()
+    graph.Run()
   except KeyboardInterrupt:
     logger.info('Keyboard interrupt - shutting down')
   finally:
-    for cfmonitor in cfmonitors:
-      cfmonitor.Shutdown()
+    graph.Shutdown()
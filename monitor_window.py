@@ -0,0 +1,31 @@
+import monitor
+
+from PyQt4 import QtCore
+from PyQt4 import QtGui
+
+class CfMonitorWindow(QtGui.QWidget):
+  def __init__(self, num_links):
+    super(CfMonitorWindow, self).__init__()
+    self.setWindowTitle('Crazyflie Monitor')
+
+    self._table = QtGui.QTableWidget(self)
+    self._table.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+    self._table.setColumnCount(len(monitor.FIELDS))
+    self._table.setRowCount(num_links)
+    self._table.setHorizontalHeaderLabels([f.label for f in monitor.FIELDS])
+    for c, field in enumerate(monitor.FIELDS):
+      self._table.setColumnWidth(c, field.width * 10)
+    for r in xrange(self._table.rowCount()):
+      for c in xrange(self._table.columnCount()):
+        self._table.setItem(r, c, QtGui.QTableWidgetItem())
+
+    self._vbox = QtGui.QVBoxLayout()
+    self._vbox.addStretch(1)
+    self._vbox.addWidget(self._table)
+    self.setLayout(self._vbox)
+
+    self.setGeometry(100, 100, 600, 200)
+    self.show()
+
+  def SetTableItemText(self, row, col, text):
+    self._table.item(row, col).setText(text)
@@ -0,0 +1,214 @@
+import cv2
+import frame_pool
+import json
+import logging
+import numpy
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger('multi_camera')
+
+class Camera(object):
+  """A calibrated camera.
+
+  projection is the 3x4 matrix mapping homogeneous world points to image
+  points.  camera_matrix and dist_coeffs are optional; when given, detected
+  points are undistorted before triangulation.  capture_latency is the
+  frame age at grab() in seconds, see frame_pool.CaptureLatency.
+  """
+  def __init__(self, source, projection, camera_matrix=None,
+               dist_coeffs=None, capture_latency=None):
+    self.source = source
+    self.capture_latency = capture_latency
+    self.projection = numpy.array(projection, dtype=numpy.float64)
+    self.camera_matrix = (None if camera_matrix is None else
+                          numpy.array(camera_matrix, dtype=numpy.float64))
+    self.dist_coeffs = (None if dist_coeffs is None else
+                        numpy.array(dist_coeffs, dtype=numpy.float64))
+
+  def Undistort(self, point):
+    if self.camera_matrix is None or self.dist_coeffs is None:
+      return point
+    src = numpy.array([[point]], dtype=numpy.float64)
+    dst = cv2.undistortPoints(src, self.camera_matrix, self.dist_coeffs,
+                              P=self.camera_matrix)
+    return tuple(dst[0][0])
+
+
+def LoadCalibration(path):
+  """Reads a JSON list of {'source', 'projection', ...} camera entries.
+
+  All projections must share one world frame in meters.  The controller
+  (multi_camera_controller) drives thrust from the world's up axis, z
+  unless told otherwise, so calibrate against a floor-based frame rather
+  than one camera's frame, where z is depth.
+  """
+  with open(path) as f:
+    return [Camera(**entry) for entry in json.load(f)]
+
+
+def Triangulate(projections, points):
+  """Least squares (DLT) 3D point seen at points by cameras projections.
+
+  Works for any number of views >= 2.  Returns a numpy array (x, y, z).
+  """
+  rows = []
+  for projection, (x, y) in zip(projections, points):
+    rows.append(x * projection[2] - projection[0])
+    rows.append(y * projection[2] - projection[1])
+  _, _, vt = numpy.linalg.svd(numpy.array(rows))
+  point = vt[-1]
+  return point[:3] / point[3]
+
+
+class CameraGrabber(object):
+  """Grabs from one camera on its own thread when triggered.
+
+  Triggering every grabber at once makes the cameras expose as close
+  together as the drivers allow, since grab() releases the GIL.  The
+  slower retrieve() (decode) then runs without holding up the others.
+  """
+  def __init__(self, source, capture_latency=None):
+    self._capture = cv2.VideoCapture()
+    self._capture.open(source)
+    if not self._capture.isOpened():
+      raise IOError('Cannot open camera %s' % source)
+    self._capture_latency = frame_pool.CaptureLatency(self._capture,
+                                                      capture_latency)
+    self._frames = frame_pool.FramePool()
+    self._cond = threading.Condition()
+    self._generation = 0
+    self._done_generation = 0
+    self._timestamp = None
+    self._frame = None
+    self._running = True
+    self._thread = threading.Thread(target=self._Run,
+                                    name='camera %s' % source)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def Trigger(self):
+    with self._cond:
+      self._generation += 1
+      self._cond.notify_all()
+
+  def Wait(self):
+    """Returns (timestamp, frame) for the last Trigger()."""
+    with self._cond:
+      while self._done_generation != self._generation and self._running:
+        self._cond.wait()
+      return self._timestamp, self._frame
+
+  def _Run(self):
+    done = 0
+    while True:
+      with self._cond:
+        while self._generation == done and self._running:
+          self._cond.wait()
+        if not self._running:
+          return
+        generation = self._generation
+      self._capture.grab()
+      timestamp = time.time() - self._capture_latency
+      _, frame = self._frames.Retrieve(self._capture)
+      done = generation
+      with self._cond:
+        self._timestamp = timestamp
+        self._frame = frame
+        self._done_generation = generation
+        self._cond.notify_all()
+
+  def Stop(self):
+    with self._cond:
+      self._running = False
+      self._cond.notify_all()
+    self._thread.join()
+    self._capture.release()
+
+
+class MultiCameraCapture(object):
+  """Synchronized capture and parallel detection over several cameras."""
+  def __init__(self, cameras, detectors, max_skew=0.010,
+               capture_latency=None):
+    """capture_latency applies to cameras that don't set their own."""
+    self._cameras = cameras
+    self._detectors = detectors
+    self._max_skew = max_skew
+    self._grabbers = [
+        CameraGrabber(camera.source,
+                      camera.capture_latency if
+                      camera.capture_latency is not None else capture_latency)
+        for camera in cameras]
+    self._pool = ThreadPool(len(cameras))
+    self._scratch = [frame_pool.Scratch() for _ in cameras]
+    self.skew = 0.0
+
+  def _Detect(self, args):
+    detector, frame, canvas = args
+    if frame is None:
+      return None
+    return detector.Detect(frame, canvas)
+
+  def Capture(self, annotate=False):
+    """Returns (timestamp, images, position).
+
+    position is the triangulated (x, y, z), or None if fewer than two
+    cameras saw the quad or the frames are further apart than max_skew.
+    images are the captured frames, or annotated copies of them if
+    annotate is set.
+    """
+    for grabber in self._grabbers:
+      grabber.Trigger()
+    shots = [grabber.Wait() for grabber in self._grabbers]
+    timestamps = [t for t, _ in shots if t is not None]
+    frames = [frame for _, frame in shots]
+    canvases = [None] * len(frames)
+    if annotate:
+      canvases = [None if frame is None else scratch.Canvas('display', frame)
+                  for scratch, frame in zip(self._scratch, frames)]
+      images = canvases
+    else:
+      images = frames
+    if not timestamps:
+      return None, images, None
+    timestamp = sum(timestamps) / len(timestamps)
+    self.skew = max(timestamps) - min(timestamps)
+    if self.skew > self._max_skew:
+      logger.debug('frames %.1fms apart, skipping', self.skew * 1000.0)
+      return timestamp, images, None
+
+    points = self._pool.map(
+        self._Detect, zip(self._detectors, frames, canvases))
+    views = [(camera.projection, camera.Undistort(point))
+             for camera, point in zip(self._cameras, points)
+             if point is not None]
+    if len(views) < 2:
+      return timestamp, images, None
+    projections, points = zip(*views)
+    return timestamp, images, Triangulate(projections, points)
+
+  def Stop(self):
+    for grabber in self._grabbers:
+      grabber.Stop()
+    self._pool.close()
+
+
+if __name__ == '__main__':
+  # two synthetic cameras looking down the z axis, 1m apart along x; this
+  # world is the first camera's frame (z is depth), fine for checking
+  # triangulation but not a frame to control in
+  logging.basicConfig(level=logging.DEBUG)
+  k = numpy.array([[500.0, 0.0, 320.0],
+                   [0.0, 500.0, 240.0],
+                   [0.0, 0.0, 1.0]])
+  p1 = k.dot(numpy.hstack([numpy.eye(3), [[0.0], [0.0], [0.0]]]))
+  p2 = k.dot(numpy.hstack([numpy.eye(3), [[-1.0], [0.0], [0.0]]]))
+  world = numpy.array([0.3, -0.2, 4.0, 1.0])
+  points = []
+  for p in (p1, p2):
+    image = p.dot(world)
+    points.append((image[0] / image[2], image[1] / image[2]))
+  logger.debug('points=%s triangulated=%s', points,
+               Triangulate([p1, p2], points))
@@ -0,0 +1,129 @@
+import cv2
+import logging
+import multi_camera
+import pid
+import position_predictor
+import quad_detector
+import time
+
+logger = logging.getLogger('multi_camera_controller')
+
+PITCH_ROLL_RANGE = 10
+
+# world units are meters
+XY_PID_GAINS = dict(kp=10.0, ki=2.0, kd=8.0, integ_max=100.0,
+                    out_min=-PITCH_ROLL_RANGE, out_max=PITCH_ROLL_RANGE)
+Z_PID_GAINS = dict(kp=20000.0, ki=5000.0, kd=15000.0, integ_max=50000.0,
+                   out_min=-4000, out_max=4000)
+
+class MultiCameraPIDController(object):
+  """Holds the quad at a 3D position seen by two or more cameras.
+
+  up_axis names the world axis pointing up ('z', '-y', ...).  Its
+  position drives thrust around the thrust level at the moment auto mode
+  was switched on; the two other axes, in x, y, z order, drive the 'x'
+  (roll) and 'y' (pitch) PIDs.  Getting it wrong ties thrust to the
+  distance from a camera or, upside down, makes altitude hold run away.
+  Without an explicit target (world coordinates) the position when auto
+  mode starts is held.
+  """
+  def __init__(self, cfmonitor, cameras, target=None, gains=None,
+               display=True, create_windows=True, detector='canny',
+               detector_options=None, window_name='Camera', predict=False,
+               up_axis='z', capture_latency=None):
+    self._cfmonitor = cfmonitor
+    if up_axis.lstrip('+-') not in ('x', 'y', 'z'):
+      raise ValueError('up_axis must be x, y or z, optionally signed, '
+                       'not %r' % up_axis)
+    up = 'xyz'.index(up_axis[-1])
+    self._up_sign = -1.0 if up_axis.startswith('-') else 1.0
+    self._axes = [i for i in xrange(3) if i != up] + [up]
+    self._window_name = window_name
+    self._display = display
+    self._target = target
+    gains = gains or {}
+
+    detectors = [quad_detector.CreateDetector(detector,
+                                              **(detector_options or {}))
+                 for _ in cameras]
+    self._capture = multi_camera.MultiCameraCapture(
+        cameras, detectors, capture_latency=capture_latency)
+
+    self._x_pid = pid.PID(**dict(XY_PID_GAINS, **gains.get('x', {})))
+    self._y_pid = pid.PID(**dict(XY_PID_GAINS, **gains.get('y', {})))
+    self._z_pid = pid.PID(**dict(Z_PID_GAINS, **gains.get('z', {})))
+    self._thrust_center = 40000
+    self._predictor = None
+    if predict:
+      self._predictor = position_predictor.PositionPredictor(
+          dims=3, process_noise=10.0, measurement_noise=0.0004)
+    self._latency = 0.0
+    self._position = None
+    self._auto = False
+    self._SetTarget(target)
+
+    if create_windows:
+      self.CreateWindows()
+
+  def CreateWindows(self):
+    self._x_pid.CreateWindow('x')
+    self._y_pid.CreateWindow('y')
+    self._z_pid.CreateWindow('z')
+
+  def GetLatency(self):
+    """Seconds from frame capture to the PID update of the last step."""
+    return self._latency
+
+  def _ToControlFrame(self, position):
+    """(horizontal, horizontal, up) from a world position."""
+    h1, h2, up = [position[i] for i in self._axes]
+    return h1, h2, up * self._up_sign
+
+  def _SetTarget(self, target):
+    if target is None:
+      return
+    self._target = tuple(target)
+    x, y, z = self._ToControlFrame(self._target)
+    self._x_pid.SetSetpoint(x)
+    self._y_pid.SetSetpoint(y)
+    self._z_pid.SetSetpoint(z)
+
+  def SetAuto(self, auto):
+    if auto and not self._auto:
+      if self._target is None and self._position is not None:
+        self._SetTarget(self._position)
+      self._thrust_center = self._cfmonitor.GetThrust()
+    self._auto = auto
+
+  def Step(self):
+    timestamp, frames, position = self._capture.Capture(
+        annotate=self._display)
+    if position is not None:
+      self._latency = time.time() - timestamp
+      if self._predictor is not None:
+        position = self._predictor.Update(position, timestamp)
+      self._position = position
+      x, y, z = self._ToControlFrame(position)
+      roll = self._x_pid.Update(x)
+      pitch = self._y_pid.Update(y)
+      thrust_delta = self._z_pid.Update(z)
+      logger.debug('3d pos: (%.3f, %.3f, %.3f)  roll: %f  pitch: %f  '
+                   'thrust_delta: %d  auto: %d  latency: %.1fms',
+                   x, y, z, roll, pitch, thrust_delta, self._auto,
+                   self._latency * 1000.0)
+      if self._auto and self._target is not None:
+        self._cfmonitor.SetRoll(roll)
+        self._cfmonitor.SetPitch(pitch)
+        self._cfmonitor.SetThrust(int(self._thrust_center + thrust_delta))
+    elif self._auto:
+      self._cfmonitor.SetRoll(0)
+      self._cfmonitor.SetPitch(0)
+
+    if self._display:
+      for i, frame in enumerate(frames):
+        if frame is not None:
+          cv2.imshow('%s %d' % (self._window_name, i), frame)
+      cv2.waitKey(1)
+
+  def Shutdown(self):
+    self._capture.Stop()
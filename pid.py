@@ -1,58 +1,116 @@
 import logging
 import time
 
-from PyQt4 import QtGui
-
 logger = logging.getLogger('pid')
 
+INF = float('inf')
+
 class PID(object):
+  """Discrete PID controller.
+
+  All variants share one update rule; the options only change the
+  coefficients it uses, which are computed once by _Compile() (or once
+  per update when running on wall-clock time):
+    fixed_dt                  step size for loops run on a schedule;
+                              None measures wall-clock time between
+                              updates, never less than min_dt
+    derivative_on_measurement differentiate -measured instead of the
+                              error, so setpoint steps don't kick
+    derivative_filter         time constant (s) of a first order low-pass
+                              on the derivative, 0 for none
+    setpoint_weight           fraction of the setpoint seen by the P term
+    tracking_time             back-calculation anti-windup time constant
+                              (s), None to rely on integ_max only
+    rate_max                  max output change per second, None for no
+                              limit
+  The defaults reproduce the plain PID.
+  """
   def __init__(self, kp=0.5, ki=0.2, kd=0.75,
-               integ_max=100.0, out_max=100, out_min=0):
+               integ_max=100.0, out_max=100, out_min=0,
+               fixed_dt=None, min_dt=0.001, derivative_on_measurement=False,
+               derivative_filter=0.0, setpoint_weight=1.0,
+               tracking_time=None, rate_max=None):
     self._kp = kp
     self._ki = ki
     self._kd = kd
     self._integ_max = integ_max
     self._out_max = out_max
     self._out_min = out_min
+    self._fixed_dt = fixed_dt
+    self._min_dt = min_dt
+    self._derivative_weight = 0.0 if derivative_on_measurement else 1.0
+    self._derivative_filter = derivative_filter
+    self._setpoint_weight = setpoint_weight
+    self._tracking_time = tracking_time
+    self._rate_max = INF if rate_max is None else rate_max
 
     self._setpoint = 0.0
-    self._last_error = 0.0
-    self._integral = 0.0
+    self._last_derivative_input = None
+    self._integral = 0.0  # in output units
+    self._derivative = 0.0
+    self._last_output = 0.0
     self._last_update_time = time.time()
+    self._Compile(fixed_dt or min_dt)
+
+  def _Compile(self, dt):
+    self._dt = dt
+    self._p_setpoint = self._kp * self._setpoint_weight
+    self._i_gain = self._ki * dt
+    self._i_max = abs(self._ki) * self._integ_max
+    self._d_decay = self._derivative_filter / (self._derivative_filter + dt)
+    self._d_gain = self._kd / (self._derivative_filter + dt)
+    if self._tracking_time:
+      self._tracking_gain = dt / self._tracking_time
+    else:
+      self._tracking_gain = 0.0
+    self._max_step = self._rate_max * dt
+
+  def SetGains(self, kp=None, ki=None, kd=None):
+    if kp is not None:
+      self._kp = kp
+    if ki is not None:
+      self._ki = ki
+    if kd is not None:
+      self._kd = kd
+    self._Compile(self._dt)
 
   def SetSetpoint(self, setpoint):
     self._setpoint = setpoint
 
   def Update(self, measured):
     now = time.time()
-    dt = now - self._last_update_time
+    if self._fixed_dt is None:
+      self._Compile(max(now - self._last_update_time, self._min_dt))
     self._last_update_time = now
 
-    error = self._setpoint - measured
-
-    self._integral += error * dt
-    if self._integral > self._integ_max:
-      self._integral = self._integ_max
-    elif self._integral < -self._integ_max:
-      self._integral = -self._integ_max
-
-    derivative = (error - self._last_error) / dt
+    setpoint = self._setpoint
+    error = setpoint - measured
+    derivative_input = self._derivative_weight * setpoint - measured
+    if self._last_derivative_input is None:
+      self._last_derivative_input = derivative_input
 
-    p = self._kp * error
-    i = self._ki * self._integral
-    d = self._kd * derivative
+    p = self._p_setpoint * setpoint - self._kp * measured
+    i = min(max(self._integral + self._i_gain * error, -self._i_max),
+            self._i_max)
+    self._derivative = (self._d_decay * self._derivative + self._d_gain *
+                        (derivative_input - self._last_derivative_input))
+    d = self._derivative
     logger.debug('p=%5f i=%5f d=%5f', p, i, d)
 
-    output = p + i + d
-    if output > self._out_max:
-      output = self._out_max
-    elif output < self._out_min:
-      output = self._out_min
+    unlimited = p + i + d
+    output = min(max(unlimited, self._out_min), self._out_max)
+    output = min(max(output, self._last_output - self._max_step),
+                 self._last_output + self._max_step)
 
-    self._last_error = error
+    # back-calculation: bleed the integral by how far the output was cut
+    self._integral = i + self._tracking_gain * (output - unlimited)
+    self._last_derivative_input = derivative_input
+    self._last_output = output
     return output
 
   def CreateWindow(self, name):
+    # imported here so PIDs can run headless without Qt installed
+    from PyQt4 import QtGui
     self._window = QtGui.QWidget()
     self._window.setWindowTitle('PID ' + name)
     grid = QtGui.QGridLayout()
@@ -60,23 +118,26 @@ class PID(object):
     edit = QtGui.QLineEdit(self._window)
     edit.setText('%f' % self._kp)
     def SetKP(text):
-      self._kp = float(text)
+      self.SetGains(kp=float(text))
     edit.textChanged[str].connect(SetKP)
     grid.addWidget(edit, 0, 1)
+    self._gain_edits = [edit]
     grid.addWidget(QtGui.QLabel('KI', self._window), 1, 0)
     edit = QtGui.QLineEdit(self._window)
     edit.setText('%f' % self._ki)
     def SetKI(text):
-      self._ki = float(text)
+      self.SetGains(ki=float(text))
     edit.textChanged[str].connect(SetKI)
     grid.addWidget(edit, 1, 1)
+    self._gain_edits.append(edit)
     grid.addWidget(QtGui.QLabel('KD', self._window), 2, 0)
     edit = QtGui.QLineEdit(self._window)
     edit.setText('%f' % self._kd)
     def SetKD(text):
-      self._kd = float(text)
+      self.SetGains(kd=float(text))
     edit.textChanged[str].connect(SetKD)
     grid.addWidget(edit, 2, 1)
+    self._gain_edits.append(edit)
     self._window.setLayout(grid)
     self._window.show()
 
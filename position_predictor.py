@@ -0,0 +1,91 @@
+import kalman
+import logging
+import numpy
+import time
+
+logger = logging.getLogger('position_predictor')
+
+class PositionPredictor(object):
+  """Pushes delayed position measurements forward to the present.
+
+  A constant velocity Kalman filter (state: position and velocity per
+  axis) is updated with each measurement at its capture time, then the
+  estimate is extrapolated by the measurement's age.  That removes the
+  camera and processing delay the PIDs would otherwise see as lag.
+  """
+  def __init__(self, dims=2, process_noise=1000.0, measurement_noise=1.0,
+               max_prediction=0.2):
+    self._dims = dims
+    self._q = process_noise        # acceleration variance, units^2/s^4
+    self._r = measurement_noise    # position variance, units^2
+    self._max_prediction = max_prediction  # seconds
+    eye = numpy.eye(dims)
+    zero = numpy.zeros((dims, dims))
+    self._H = numpy.mat(numpy.hstack([eye, zero]))
+    self._filter = None
+    self._last_timestamp = None
+
+    self.latency = 0.0
+    self.mean_latency = 0.0
+    self.max_latency = 0.0
+
+  def Reset(self):
+    self._filter = None
+    self._last_timestamp = None
+
+  def _Model(self, dt):
+    eye = numpy.eye(self._dims)
+    zero = numpy.zeros((self._dims, self._dims))
+    A = numpy.mat(numpy.vstack([numpy.hstack([eye, dt * eye]),
+                                numpy.hstack([zero, eye])]))
+    Q = self._q * numpy.mat(numpy.vstack([
+        numpy.hstack([dt ** 3 / 3.0 * eye, dt ** 2 / 2.0 * eye]),
+        numpy.hstack([dt ** 2 / 2.0 * eye, dt * eye])]))
+    return A, Q
+
+  def Update(self, position, timestamp, now=None):
+    """Returns position, captured at timestamp, predicted for now."""
+    if now is None:
+      now = time.time()
+    measurement = numpy.mat(position, dtype=numpy.float64).reshape(
+        (self._dims, 1))
+
+    if self._filter is None:
+      x = numpy.mat(numpy.vstack([measurement,
+                                  numpy.zeros((self._dims, 1))]))
+      P = numpy.mat(numpy.eye(2 * self._dims)) * 1000.0
+      A, Q = self._Model(0.0)
+      self._filter = kalman.KalmanFilter(
+          A, numpy.mat(numpy.zeros((2 * self._dims, 1))), self._H, x, P, Q,
+          numpy.mat(numpy.eye(self._dims)) * self._r)
+      self._last_timestamp = timestamp
+    else:
+      dt = timestamp - self._last_timestamp
+      if dt > 0:
+        A, Q = self._Model(dt)
+        self._filter.SetTransition(A, Q)
+        self._filter.Step(0, measurement)
+        self._last_timestamp = timestamp
+
+    self.latency = now - timestamp
+    self.mean_latency = self.mean_latency * 0.95 + self.latency * 0.05
+    self.max_latency = max(self.max_latency, self.latency)
+
+    state = self._filter.GetState()
+    ahead = min(max(self.latency, 0.0), self._max_prediction)
+    predicted = state[:self._dims] + state[self._dims:] * ahead
+    return tuple(numpy.asarray(predicted).ravel())
+
+
+if __name__ == '__main__':
+  # a target moving at constant speed, seen 50ms late with noise
+  import random
+  logging.basicConfig(level=logging.DEBUG)
+  predictor = PositionPredictor(dims=1, measurement_noise=4.0)
+  delay = 0.05
+  for i in xrange(60):
+    t = i / 30.0
+    measured = 100.0 * (t - delay) + random.gauss(0.0, 2.0)
+    predicted = predictor.Update([measured], t - delay, now=t)
+    logger.debug('true=%7.2f measured=%7.2f predicted=%7.2f',
+                 100.0 * t, measured, predicted[0])
@@ -1,19 +1,34 @@
+import gain_schedule
 import logging
-import pid
 
 logger = logging.getLogger('pressure_thrust_controller')
 
+PID_GAINS = dict(kp=10000.0, ki=5000.0, kd=15000.0, integ_max=50000.0,
+                 out_min=-4000, out_max=4000)
+
 class PressureThrustController(object):
-  def __init__(self, cfmonitor):
+  # gain_table (see gain_schedule) may be scheduled on 'thrust' and
+  # 'pressure'
+  def __init__(self, cfmonitor, gains=None, create_windows=True,
+               gain_table=None):
     self._cfmonitor = cfmonitor
-    self._pid = pid.PID(kp=10000.0, ki=5000.0, kd=15000.0,
-                        integ_max=50000.0,
-                        out_min=-4000, out_max=4000)
+    gains = gains or {}
+    self._pid = gain_schedule.CreatePID(
+        gain_table, self._OperatingPoint,
+        **dict(PID_GAINS, **gains.get('thrust', {})))
     self._target_pressure = 100.0
     self._thrust_center = 40000
     self._auto = False
+    if create_windows:
+      self.CreateWindows()
+
+  def CreateWindows(self):
     self._pid.CreateWindow('thrust')
 
+  def _OperatingPoint(self):
+    return {'thrust': self._cfmonitor.GetThrust(),
+            'pressure': self._cfmonitor.GetPressure()}
+
   def SetAuto(self, auto):
     if auto and not self._auto:
       self._target_pressure = self._cfmonitor.GetPressure()
@@ -0,0 +1,283 @@
+import ctypes
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+logger = logging.getLogger('process_workers')
+
+# main -> worker, once per graph step: SNAPSHOT_HEADER then, per link,
+# SNAPSHOT_FIELDS
+SNAPSHOT_HEADER = ['heartbeat', 'auto', 'set_count']
+SNAPSHOT_FIELDS = ['pressure', 'mag_x', 'mag_y', 'mag_z',
+                   'acc_x', 'acc_y', 'acc_z', 'thrust']
+# worker -> main, once per worker step: heartbeat then, per link, the four
+# setpoint values followed by a generation count per value, bumped
+# whenever a controller in the worker sets it
+AXES = ['roll', 'pitch', 'yaw', 'thrust']
+
+class SharedRecord(object):
+  """Fixed size record of floats in shared memory; one writer, any readers.
+
+  A seqlock: the writer makes the sequence number odd while it writes and
+  even again once done, readers retry if it was odd or moved while they
+  copied.  There is no lock; a reader gives up after timeout seconds
+  (a writer killed mid-write leaves the sequence odd for good) and gets
+  None instead.
+  """
+  def __init__(self, size):
+    self.size = size
+    self._array = multiprocessing.RawArray(ctypes.c_double, size + 1)
+
+  def Write(self, values):
+    array = self._array
+    seq = array[0]
+    array[0] = seq + 1
+    array[1:self.size + 1] = values
+    array[0] = seq + 2
+
+  def Read(self, timeout=0.005):
+    array = self._array
+    deadline = time.time() + timeout
+    while True:
+      seq = array[0]
+      if seq % 2 == 0:
+        values = array[1:self.size + 1]
+        if array[0] == seq:
+          return values
+      if time.time() > deadline:
+        return None
+      time.sleep(0)
+
+
+class WorkerCfMonitor(object):
+  """The part of monitor.CfMonitor controllers use, inside a worker.
+
+  Getters read the last snapshot from the main process, setters are
+  collected and sent back with the next setpoint record.
+  """
+  def __init__(self, index):
+    self._offset = len(SNAPSHOT_HEADER) + index * len(SNAPSHOT_FIELDS)
+    self._snapshot = [0.0] * (self._offset + len(SNAPSHOT_FIELDS))
+    self._setpoints = [0.0] * len(AXES)
+    self._generations = [0] * len(AXES)
+
+  def Update(self, snapshot):
+    self._snapshot = snapshot
+
+  def _Get(self, field):
+    return self._snapshot[self._offset + SNAPSHOT_FIELDS.index(field)]
+
+  def _Set(self, axis, value):
+    self._setpoints[axis] = value
+    self._generations[axis] += 1
+
+  def GetSetpoints(self):
+    return self._setpoints + self._generations
+
+  def GetPressure(self):
+    return self._Get('pressure')
+
+  def GetMagX(self):
+    return self._Get('mag_x')
+
+  def GetMagY(self):
+    return self._Get('mag_y')
+
+  def GetMagZ(self):
+    return self._Get('mag_z')
+
+  def GetAccX(self):
+    return self._Get('acc_x')
+
+  def GetAccY(self):
+    return self._Get('acc_y')
+
+  def GetAccZ(self):
+    return self._Get('acc_z')
+
+  def GetThrust(self):
+    return int(self._Get('thrust'))
+
+  def SetRoll(self, roll):
+    self._Set(0, roll)
+
+  def SetPitch(self, pitch):
+    self._Set(1, pitch)
+
+  def SetYaw(self, yaw):
+    self._Set(2, yaw)
+
+  def SetThrust(self, thrust):
+    self._Set(3, thrust)
+
+
+class WorkerProcess(object):
+  """Runs a group of controllers in their own process.
+
+  build(spec, cfmonitor) constructs a controller graph node; it is called
+  in the worker after the fork, so cameras, OpenCV and numpy state never
+  exist in the main process.  In the main process this object stands in
+  for the controllers: Step() sends a telemetry snapshot and applies every
+  setpoint the worker produced since the last step, in the graph's node
+  order, without ever waiting on the worker.
+
+  Watchdog: if the worker's heartbeat is older than timeout (it is stuck
+  in a frame grab, for instance, or died) while auto mode is on, thrust
+  of the links it drives is held at zero.  When it recovers, the last
+  thrust set before or during the stall by anything else (joystick,
+  other controllers) is restored; leaving auto mode instead hands
+  control back to the joystick, which reapplies its sticks.  A worker
+  exits by itself when the main process goes away.
+  """
+  def __init__(self, name, specs, build, num_links, period, timeout=0.5):
+    self.name = name
+    self._specs = specs
+    self._build = build
+    self._num_links = num_links
+    self._period = period
+    self._timeout = timeout
+    self._links = sorted(set(spec.get('link', 0) for spec in specs))
+
+    self._snapshot = SharedRecord(
+        len(SNAPSHOT_HEADER) + num_links * len(SNAPSHOT_FIELDS))
+    self._setpoints = SharedRecord(1 + num_links * 2 * len(AXES))
+    self._stop = multiprocessing.Event()
+    self._parent_pid = os.getpid()
+    self._process = multiprocessing.Process(target=self._Run,
+                                            name='%s worker' % name)
+    self._process.daemon = True
+
+    self._cfmonitors = []
+    self._auto = False
+    self._set_count = 0
+    self._generations = [[0] * len(AXES) for _ in xrange(num_links)]
+    self._failsafe = False
+    self._held_thrust = {}
+
+  def Start(self):
+    """Forks the worker; call before starting threads or Qt."""
+    self._process.start()
+    logger.info('Started %s worker (pid %d): %s', self.name,
+                self._process.pid,
+                ', '.join(spec['type'] for spec in self._specs))
+
+  def SetCfMonitors(self, cfmonitors):
+    self._cfmonitors = cfmonitors
+
+  def SetAuto(self, auto):
+    self._auto = auto
+
+  def SetTarget(self):
+    self._set_count += 1
+
+  def Step(self):
+    now = time.time()
+    snapshot = [now, float(self._auto), self._set_count]
+    for cfmonitor in self._cfmonitors:
+      snapshot += [cfmonitor.GetPressure(),
+                   cfmonitor.GetMagX(), cfmonitor.GetMagY(),
+                   cfmonitor.GetMagZ(),
+                   cfmonitor.GetAccX(), cfmonitor.GetAccY(),
+                   cfmonitor.GetAccZ(),
+                   cfmonitor.GetThrust()]
+    self._snapshot.Write(snapshot)
+
+    setpoints = self._setpoints.Read()
+    # None: the worker died or stalled in the middle of a write
+    age = now - setpoints[0] if setpoints is not None else float('inf')
+    stale = age > self._timeout or not self._process.is_alive()
+    if stale and self._auto:
+      if not self._failsafe:
+        logger.error('%s worker stalled (%s), cutting thrust', self.name,
+                     'torn record' if setpoints is None else '%.2fs' % age)
+        self._failsafe = True
+        self._held_thrust = {}
+      for index in self._links:
+        cfmonitor = self._cfmonitors[index]
+        # non-zero means someone set thrust since the last step
+        if cfmonitor.GetThrust():
+          self._held_thrust[index] = cfmonitor.GetThrust()
+        cfmonitor.SetThrust(0)
+      return
+    if self._failsafe:
+      self._failsafe = False
+      if self._auto:
+        logger.warning('%s worker recovered, restoring thrust', self.name)
+        for index, thrust in self._held_thrust.items():
+          self._cfmonitors[index].SetThrust(thrust)
+      else:
+        logger.warning('%s worker failsafe cleared, auto mode is off',
+                       self.name)
+    if stale:
+      return
+
+    for index, cfmonitor in enumerate(self._cfmonitors):
+      base = 1 + index * 2 * len(AXES)
+      values = setpoints[base:base + len(AXES)]
+      generations = setpoints[base + len(AXES):base + 2 * len(AXES)]
+      applied = self._generations[index]
+      setters = (cfmonitor.SetRoll, cfmonitor.SetPitch, cfmonitor.SetYaw,
+                 lambda thrust: cfmonitor.SetThrust(int(thrust)))
+      for axis, setter in enumerate(setters):
+        if generations[axis] != applied[axis]:
+          setter(values[axis])
+          applied[axis] = generations[axis]
+
+  def Shutdown(self):
+    self._stop.set()
+    self._process.join(2.0)
+    if self._process.is_alive():
+      logger.warning('%s worker did not stop, terminating', self.name)
+      self._process.terminate()
+
+  def _Run(self):
+    # the main process handles Ctrl-C and stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    cfmonitors = [WorkerCfMonitor(i) for i in xrange(self._num_links)]
+    nodes = []
+    for spec in self._specs:
+      try:
+        nodes.append(self._build(spec, cfmonitors[spec.get('link', 0)]))
+      except Exception:
+        logger.exception('Failed to start %s controller, skipping',
+                         spec['type'])
+
+    set_count = 0
+    next_time = time.time()
+    while not self._stop.is_set() and os.getppid() == self._parent_pid:
+      snapshot = self._snapshot.Read()
+      if snapshot is None:
+        continue
+      for cfmonitor in cfmonitors:
+        cfmonitor.Update(snapshot)
+      auto = bool(snapshot[1])
+      if snapshot[2] != set_count:
+        set_count = snapshot[2]
+        for node in nodes:
+          if hasattr(node.controller, 'SetTarget'):
+            node.controller.SetTarget()
+
+      now = time.time()
+      for node in nodes:
+        if hasattr(node.controller, 'SetAuto'):
+          node.controller.SetAuto(auto)
+        if now >= node.next_step:
+          node.controller.Step()
+          node.next_step = now + node.period
+      setpoints = [time.time()]
+      for cfmonitor in cfmonitors:
+        setpoints += cfmonitor.GetSetpoints()
+      self._setpoints.Write(setpoints)
+
+      next_time += self._period
+      delay = next_time - time.time()
+      if delay > 0:
+        time.sleep(delay)
+      else:
+        next_time = time.time()
+
+    for node in nodes:
+      if hasattr(node.controller, 'Shutdown'):
+        node.controller.Shutdown()
@@ -0,0 +1,205 @@
+import cv2
+import frame_pool
+import logging
+import numpy
+
+logger = logging.getLogger('quad_detector')
+
+CANNY_THRESHOLD = 15
+
+# modes for CannyDetector
+DETECT_CONTOURS = 'contours'      # largest contour, bounding rect centre
+DETECT_COMPONENTS = 'components'  # largest connected component, centroid
+
+class QuadDetector(object):
+  """Finds the quad in a camera frame.
+
+  Detect() returns the (x, y) image position or None.  im is only read;
+  if canvas (an image of the same size) is given, what was found is drawn
+  into it for display.
+  """
+  def Detect(self, im, canvas=None):
+    raise NotImplementedError("Should have implemented Detect")
+
+  def Reset(self):
+    pass
+
+
+class CannyDetector(QuadDetector):
+  """Edge based detector: the largest blob of dilated Canny edges."""
+  def __init__(self, mode=DETECT_CONTOURS):
+    self._mode = mode
+    self._element = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (15, 15))
+    self._scratch = frame_pool.Scratch()
+
+  def _FindEdges(self, im):
+    # every stage writes into a buffer reused from the previous frame
+    shape = im.shape[:2]
+    gray_im = self._scratch.Get('gray', shape)
+    blurred = self._scratch.Get('blurred', shape)
+    edges = self._scratch.Get('edges', shape)
+    dilated = self._scratch.Get('dilated', shape)
+    cv2.cvtColor(im, cv2.COLOR_RGB2GRAY, gray_im)
+    cv2.blur(gray_im, (5, 5), blurred)
+    cv2.Canny(blurred, CANNY_THRESHOLD, CANNY_THRESHOLD * 3, edges)
+    cv2.dilate(edges, self._element, dilated)
+    return dilated
+
+  def Detect(self, im, canvas=None):
+    edges = self._FindEdges(im)
+    if self._mode == DETECT_COMPONENTS:
+      return _FindLargestComponent(edges, canvas)
+    return self._FindLargestContour(edges, canvas)
+
+  def _FindLargestContour(self, edges, canvas):
+    contours, _ = cv2.findContours(
+        edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+
+    max_area = 0
+    largest_contour = None
+    for contour in contours:
+      area = cv2.contourArea(contour)
+      if area > max_area:
+        max_area = area
+        largest_contour = contour
+
+    if largest_contour is not None:
+      bounding_rect = cv2.boundingRect(largest_contour)
+      x = bounding_rect[0] + bounding_rect[2] / 2
+      y = bounding_rect[1] + bounding_rect[3] / 2
+
+      if canvas is not None:
+        cv2.drawContours(canvas, [largest_contour], -1, (255, 128, 128), 1)
+        cv2.rectangle(canvas,
+                      (bounding_rect[0], bounding_rect[1]),
+                      (bounding_rect[0] + bounding_rect[2],
+                       bounding_rect[1] + bounding_rect[3]),
+                      (255, 255, 255))
+        cv2.circle(canvas, (x,y), 2, (0, 0, 255))
+
+      return (x, y)
+    else:
+      return None
+
+
+def _FindLargestComponent(mask, canvas, offset=(0, 0), scale=1.0,
+                          min_area=0):
+  # areas and centroids of every blob in one vectorized call instead of a
+  # Python loop over contours; the centroid is the sub-pixel first moment
+  # of the blob's pixels, which jitters less than a bounding rect centre.
+  # offset and scale map mask coordinates back to frame coordinates.
+  count, _, stats, centroids = cv2.connectedComponentsWithStats(mask)
+  if count < 2:
+    return None
+  # label 0 is the background
+  label = 1 + numpy.argmax(stats[1:, cv2.CC_STAT_AREA])
+  if stats[label, cv2.CC_STAT_AREA] < min_area:
+    return None
+  x = (centroids[label][0] + offset[0]) / scale
+  y = (centroids[label][1] + offset[1]) / scale
+
+  if canvas is not None:
+    left = (stats[label, cv2.CC_STAT_LEFT] + offset[0]) / scale
+    top = (stats[label, cv2.CC_STAT_TOP] + offset[1]) / scale
+    cv2.rectangle(canvas, (int(left), int(top)),
+                  (int(left + stats[label, cv2.CC_STAT_WIDTH] / scale),
+                   int(top + stats[label, cv2.CC_STAT_HEIGHT] / scale)),
+                  (255, 255, 255))
+    cv2.circle(canvas, (int(x), int(y)), 2, (0, 0, 255))
+
+  return (x, y)
+
+
+def _CreateBackgroundSubtractor(history, var_threshold):
+  if hasattr(cv2, 'createBackgroundSubtractorMOG2'):
+    return cv2.createBackgroundSubtractorMOG2(
+        history=history, varThreshold=var_threshold, detectShadows=True)
+  # OpenCV 2.4
+  return cv2.BackgroundSubtractorMOG2(history, var_threshold, True)
+
+
+class BackgroundDetector(QuadDetector):
+  """Detects motion against a running background model (MOG2).
+
+  The camera is static, so everything but the quad settles into the
+  background.  The background model runs on a downscaled frame, and a
+  motion prior (last position plus velocity) restricts the blob search to
+  a window around where the quad should be.  After max_misses frames
+  without a detection the search falls back to the whole frame.
+  """
+  def __init__(self, history=500, var_threshold=16.0, scale=0.5,
+               search_radius=60, min_area=10, max_misses=5):
+    self._history = history
+    self._var_threshold = var_threshold
+    self._scale = scale
+    self._search_radius = search_radius  # in downscaled pixels
+    self._min_area = min_area            # in downscaled pixels
+    self._max_misses = max_misses
+    self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    self._scratch = frame_pool.Scratch()
+    self.Reset()
+
+  def Reset(self):
+    self._subtractor = _CreateBackgroundSubtractor(self._history,
+                                                   self._var_threshold)
+    self._position = None  # last position, downscaled pixels
+    self._velocity = (0.0, 0.0)
+    self._misses = 0
+
+  def Detect(self, im, canvas=None):
+    size = (int(im.shape[1] * self._scale), int(im.shape[0] * self._scale))
+    small = self._scratch.Get('small', (size[1], size[0]) + im.shape[2:])
+    mask = self._scratch.Get('mask', (size[1], size[0]))
+    cv2.resize(im, size, small, interpolation=cv2.INTER_AREA)
+    self._subtractor.apply(small, mask)
+    # shadows are marked 127, only keep confident foreground
+    cv2.threshold(mask, 200, 255, cv2.THRESH_BINARY, mask)
+
+    height, width = mask.shape[:2]
+    if self._position is not None and self._misses < self._max_misses:
+      # widen the window the longer the quad has been lost
+      radius = self._search_radius * (1 + self._misses)
+      px = self._position[0] + self._velocity[0] * (1 + self._misses)
+      py = self._position[1] + self._velocity[1] * (1 + self._misses)
+      left = int(max(0, min(width - 1, px - radius)))
+      top = int(max(0, min(height - 1, py - radius)))
+      right = int(max(left + 1, min(width, px + radius)))
+      bottom = int(max(top + 1, min(height, py + radius)))
+    else:
+      left, top, right, bottom = 0, 0, width, height
+
+    window = mask[top:bottom, left:right]
+    cv2.morphologyEx(window, cv2.MORPH_OPEN, self._kernel, window)
+    position = _FindLargestComponent(window, canvas,
+                                     offset=(left, top), scale=self._scale,
+                                     min_area=self._min_area)
+    if canvas is not None:
+      cv2.rectangle(canvas,
+                    (int(left / self._scale), int(top / self._scale)),
+                    (int(right / self._scale), int(bottom / self._scale)),
+                    (0, 255, 255))
+
+    if position is None:
+      self._misses += 1
+      return None
+
+    small_position = (position[0] * self._scale, position[1] * self._scale)
+    if self._position is None or self._misses >= self._max_misses:
+      # reacquired after a full frame search, the old track means nothing
+      self._velocity = (0.0, 0.0)
+    else:
+      steps = 1 + self._misses
+      self._velocity = ((small_position[0] - self._position[0]) / steps,
+                        (small_position[1] - self._position[1]) / steps)
+    self._position = small_position
+    self._misses = 0
+    return position
+
+
+DETECTORS = {
+    'canny': CannyDetector,
+    'background': BackgroundDetector,
+}
+
+def CreateDetector(name, **kwargs):
+  return DETECTORS[name](**kwargs)
@@ -0,0 +1,328 @@
+import collections
+import errno
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+import time
+
+logger = logging.getLogger('telemetry_server')
+
+# Every frame is HEADER (type, topic id, payload length) plus payload.
+HEADER = struct.Struct('<BHH')
+MAX_TOPICS = 0x10000
+# server -> client: topic name, NUL, comma separated field names
+FRAME_SCHEMA = 1
+# server -> client: DATA_HEADER then one float32 per field
+FRAME_DATA = 2
+DATA_HEADER = struct.Struct('<Id')  # sequence number, timestamp
+# client -> server: SUBSCRIBE_HEADER then comma separated topic names
+# (empty for all topics)
+FRAME_SUBSCRIBE = 3
+SUBSCRIBE_HEADER = struct.Struct('<f')  # max rate per topic in Hz, 0 = all
+
+
+def ParseAddress(address):
+  """'host:port' for TCP, anything else is a Unix socket path."""
+  if isinstance(address, tuple):
+    return address
+  host, sep, port = address.rpartition(':')
+  if sep and port.isdigit():
+    return (host or 'localhost', int(port))
+  return address
+
+
+def _CreateSocket(address):
+  if isinstance(address, tuple):
+    return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+
+def _Frame(frame_type, topic, payload):
+  return HEADER.pack(frame_type, topic, len(payload)) + payload
+
+
+def _ReadFrames(buf):
+  """Splits complete frames off buf; returns (frames, rest)."""
+  frames = []
+  while len(buf) >= HEADER.size:
+    frame_type, topic, length = HEADER.unpack_from(buf)
+    end = HEADER.size + length
+    if len(buf) < end:
+      break
+    frames.append((frame_type, topic, buf[HEADER.size:end]))
+    buf = buf[end:]
+  return frames, buf
+
+
+class _Client(object):
+  def __init__(self, sock, queue_size):
+    self.sock = sock
+    self.inbuf = ''
+    self.out = ''            # bytes being sent, never dropped
+    self.queue = collections.deque(maxlen=queue_size)  # data, oldest dropped
+    self.topics = set()      # None = all; nothing until subscribed
+    self.min_interval = 0.0
+    self.last_sent = {}
+    self.dropped = 0
+    self.blocked_since = None
+
+  def fileno(self):
+    return self.sock.fileno()
+
+
+class TelemetryServer(object):
+  """Streams telemetry topics to any number of local subscribers.
+
+  Publish() only packs a frame and appends it to a queue, so the control
+  loop never touches a socket.  A separate thread fans frames out with
+  select().  Each client gets its own bounded queue (oldest frames are
+  dropped when it falls behind), optional downsampling to the rate it
+  asked for, and is disconnected if its socket stays blocked for longer
+  than slow_timeout.
+  """
+  def __init__(self, address='localhost:5555', queue_size=64,
+               max_buffer=65536, slow_timeout=2.0):
+    self._address = ParseAddress(address)
+    self._queue_size = queue_size
+    self._max_buffer = max_buffer
+    self._slow_timeout = slow_timeout
+
+    self._lock = threading.Lock()
+    self._topics = []          # (name, fields, data struct)
+    self._sequence = []
+    self._pending = collections.deque()
+    self._new_schemas = []
+    self._signaled = False
+    self._clients = []
+    self._listener = None
+    self._wake_write = None
+    self._running = False
+    self._thread = None
+
+  def Start(self):
+    if not isinstance(self._address, tuple) and os.path.exists(
+        self._address):
+      os.unlink(self._address)
+    self._listener = _CreateSocket(self._address)
+    self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._listener.bind(self._address)
+    self._listener.listen(16)
+    self._listener.setblocking(False)
+    self._wake_read, self._wake_write = os.pipe()
+    self._running = True
+    self._thread = threading.Thread(target=self._Run, name='telemetry')
+    self._thread.daemon = True
+    self._thread.start()
+    logger.info('Serving telemetry on %s', self._address)
+
+  def Stop(self):
+    if self._thread is None:
+      # Start() failed or was never called
+      if self._listener is not None:
+        self._listener.close()
+      return
+    self._running = False
+    self._Wake()
+    self._thread.join()
+
+  def AddTopic(self, name, fields):
+    """Registers a topic; returns the id to pass to Publish()."""
+    with self._lock:
+      topic = len(self._topics)
+      if topic >= MAX_TOPICS:
+        raise ValueError('too many telemetry topics (%d)' % MAX_TOPICS)
+      self._topics.append((name, list(fields),
+                           struct.Struct('<%df' % len(fields))))
+      self._sequence.append(0)
+      self._new_schemas.append(topic)
+    self._Wake()
+    return topic
+
+  def Publish(self, topic, values, timestamp=None):
+    """values are in the order of the topic's fields."""
+    if timestamp is None:
+      timestamp = time.time()
+    _, _, data = self._topics[topic]
+    self._sequence[topic] += 1
+    payload = (DATA_HEADER.pack(self._sequence[topic] & 0xffffffff,
+                                timestamp) + data.pack(*values))
+    self._pending.append((topic, timestamp, _Frame(FRAME_DATA, topic,
+                                                   payload)))
+    if not self._signaled:
+      self._Wake()
+
+  def _Wake(self):
+    self._signaled = True
+    if self._wake_write is not None:
+      os.write(self._wake_write, 'x')
+
+  def _Schema(self, topic):
+    name, fields, _ = self._topics[topic]
+    return _Frame(FRAME_SCHEMA, topic, name + '\0' + ','.join(fields))
+
+  def _Run(self):
+    while self._running:
+      writers = [c for c in self._clients if c.out or c.queue]
+      readable, writable, _ = select.select(
+          [self._listener, self._wake_read] + self._clients, writers, [], 1.0)
+      now = time.time()
+      if self._wake_read in readable:
+        os.read(self._wake_read, 4096)
+        self._signaled = False
+      if self._listener in readable:
+        self._Accept()
+      for client in readable:
+        if isinstance(client, _Client):
+          self._Guarded(self._Receive, client)
+      self._Dispatch(now)
+      for client in list(self._clients):
+        if client.out or client.queue:
+          self._Guarded(self._Send, client, now)
+    for client in list(self._clients):
+      self._Drop(client, 'server stopping')
+    self._listener.close()
+    if not isinstance(self._address, tuple):
+      os.unlink(self._address)
+
+  def _Guarded(self, fn, client, *args):
+    """Runs per-client work; a failure drops that client only."""
+    try:
+      fn(client, *args)
+    except Exception:
+      logger.exception('Telemetry client failed')
+      if client in self._clients:
+        self._Drop(client, 'error')
+
+  def _Accept(self):
+    try:
+      sock, _ = self._listener.accept()
+    except socket.error:
+      return
+    sock.setblocking(False)
+    client = _Client(sock, self._queue_size)
+    with self._lock:
+      client.out = ''.join(self._Schema(topic)
+                           for topic in xrange(len(self._topics)))
+    self._clients.append(client)
+    logger.info('Telemetry client connected (%d total)', len(self._clients))
+
+  def _Receive(self, client):
+    try:
+      data = client.sock.recv(4096)
+    except socket.error as e:
+      if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+        return
+      data = ''
+    if not data:
+      self._Drop(client, 'closed')
+      return
+    frames, client.inbuf = _ReadFrames(client.inbuf + data)
+    for frame_type, _, payload in frames:
+      if frame_type == FRAME_SUBSCRIBE:
+        if len(payload) < SUBSCRIBE_HEADER.size:
+          self._Drop(client, 'bad subscribe frame')
+          return
+        rate, = SUBSCRIBE_HEADER.unpack_from(payload)
+        names = payload[SUBSCRIBE_HEADER.size:]
+        client.min_interval = 1.0 / rate if rate > 0 else 0.0
+        client.topics = set(names.split(',')) if names else None
+
+  def _Dispatch(self, now):
+    with self._lock:
+      schemas = ''.join(self._Schema(topic) for topic in self._new_schemas)
+      self._new_schemas = []
+    if schemas:
+      for client in self._clients:
+        client.out += schemas
+    while self._pending:
+      topic, timestamp, frame = self._pending.popleft()
+      name = self._topics[topic][0]
+      for client in self._clients:
+        if client.topics is not None and name not in client.topics:
+          continue
+        if timestamp - client.last_sent.get(topic, 0.0) < client.min_interval:
+          continue
+        client.last_sent[topic] = timestamp
+        if len(client.queue) == client.queue.maxlen:
+          client.dropped += 1
+        client.queue.append(frame)
+
+  def _Send(self, client, now):
+    while client.queue and len(client.out) < self._max_buffer:
+      client.out += client.queue.popleft()
+    try:
+      sent = client.sock.send(client.out)
+    except socket.error as e:
+      if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+        self._Drop(client, str(e))
+        return
+      sent = 0
+    client.out = client.out[sent:]
+    if not client.out and not client.queue:
+      client.blocked_since = None
+    elif sent == 0:
+      if client.blocked_since is None:
+        client.blocked_since = now
+      elif now - client.blocked_since > self._slow_timeout:
+        self._Drop(client, 'too slow')
+
+  def _Drop(self, client, reason):
+    logger.info('Telemetry client dropped: %s (%d frames skipped)',
+                reason, client.dropped)
+    client.sock.close()
+    self._clients.remove(client)
+
+
+class TelemetryClient(object):
+  """Blocking subscriber, for dashboards, recorders and tuning tools."""
+  def __init__(self, address='localhost:5555', topics=None, max_rate=0.0):
+    address = ParseAddress(address)
+    self._sock = _CreateSocket(address)
+    self._sock.connect(address)
+    self._sock.sendall(_Frame(
+        FRAME_SUBSCRIBE, 0,
+        SUBSCRIBE_HEADER.pack(max_rate) + ','.join(topics or [])))
+    self._buf = ''
+    self._topics = {}
+
+  def Read(self):
+    """Yields (topic name, sequence, timestamp, {field: value})."""
+    while True:
+      frames, self._buf = _ReadFrames(self._buf)
+      for frame_type, topic, payload in frames:
+        if frame_type == FRAME_SCHEMA:
+          name, fields = payload.split('\0')
+          fields = fields.split(',') if fields else []
+          self._topics[topic] = (name, fields,
+                                 struct.Struct('<%df' % len(fields)))
+        elif frame_type == FRAME_DATA and topic in self._topics:
+          name, fields, data = self._topics[topic]
+          seq, timestamp = DATA_HEADER.unpack_from(payload)
+          values = data.unpack_from(payload, DATA_HEADER.size)
+          yield name, seq, timestamp, dict(zip(fields, values))
+      data = self._sock.recv(65536)
+      if not data:
+        return
+      self._buf += data
+
+  def Close(self):
+    self._sock.close()
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description='Print live telemetry')
+  parser.add_argument('--connect', default='localhost:5555')
+  parser.add_argument('--rate', type=float, default=0.0)
+  parser.add_argument('topics', nargs='*')
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.INFO)
+
+  client = TelemetryClient(args.connect, args.topics, args.rate)
+  for name, seq, timestamp, values in client.Read():
+    print '%.3f %s #%d %s' % (
+        timestamp, name, seq,
+        '  '.join('%s=%g' % item for item in sorted(values.items())))
@@ -1,90 +1,113 @@
 import cv2
+import frame_pool
 import logging
 import pid
+import position_predictor
+import quad_detector
+import time
 
 logger = logging.getLogger('video_pid_controller')
 
-CANNY_THRESHOLD = 15
 PITCH_ROLL_RANGE = 10
 
+PID_GAINS = dict(kp=0.5, ki=0.2, kd=1.1, integ_max=100.0,
+                 out_min=-PITCH_ROLL_RANGE, out_max=PITCH_ROLL_RANGE)
+
 class VideoPIDController(object):
-  def __init__(self, cfmonitor, window_name='Controller', camera_index=1):
+  def __init__(self, cfmonitor, window_name='Controller', camera_index=1,
+               gains=None, display=True, create_windows=True,
+               detector=None, predict=False, capture_latency=None):
     self._cfmonitor = cfmonitor
     self._window_name = window_name
+    self._display = display
+    if detector is None:
+      detector = quad_detector.CannyDetector()
+    self._detector = detector
+    gains = gains or {}
 
     self._capture = cv2.VideoCapture()
     self._capture.open(camera_index)
+    if not self._capture.isOpened():
+      raise IOError('Cannot open camera %s' % camera_index)
+    self._frames = frame_pool.FramePool()
+    self._scratch = frame_pool.Scratch()
     self._width = self._capture.get(3)
     self._height = self._capture.get(4)
-    logger.debug('width: %d, height: %d', self._width, self._height)
+    self._capture_latency = frame_pool.CaptureLatency(self._capture,
+                                                      capture_latency)
+    logger.debug('width: %d, height: %d, capture latency: %.1fms',
+                 self._width, self._height, self._capture_latency * 1000.0)
 
     self._x_target = self._width / 2
     self._y_target = self._height / 2
-    self._x_pid = pid.PID(kp=0.5, ki=0.2, kd=1.1, integ_max=100.0,
-                          out_min=-PITCH_ROLL_RANGE, out_max=PITCH_ROLL_RANGE)
+    x_gains = dict(PID_GAINS, **gains.get('x', {}))
+    self._x_pid = pid.PID(**x_gains)
     self._x_pid.SetSetpoint(self._x_target)
-    self._y_pid = pid.PID(kp=0.5, ki=0.2, kd=1.1, integ_max=100.0,
-                          out_min=-PITCH_ROLL_RANGE, out_max=PITCH_ROLL_RANGE)
+    y_gains = dict(PID_GAINS, **gains.get('y', {}))
+    self._y_pid = pid.PID(**y_gains)
     self._y_pid.SetSetpoint(self._y_target)
 
+    # compensates the capture to control latency, see position_predictor
+    self._predictor = None
+    if predict:
+      self._predictor = position_predictor.PositionPredictor(
+          dims=2, measurement_noise=4.0)
+    self._latency = 0.0
+
+    if create_windows:
+      self.CreateWindows()
+
+    self._auto = False
+
+  def CreateWindows(self):
     self._x_pid.CreateWindow('x')
     self._y_pid.CreateWindow('y')
 
-    self._auto = False
+  def GetLatency(self):
+    """Seconds from frame capture to the PID update of the last step."""
+    return self._latency
 
-  def _FindQuad(self, im):
-    gray_im = cv2.cvtColor(im, cv2.COLOR_RGB2GRAY)
-    gray_im = cv2.blur(gray_im, (5, 5))
-    edges = cv2.Canny(gray_im, CANNY_THRESHOLD, CANNY_THRESHOLD * 3)
-    element = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (15, 15))
-    edges = cv2.dilate(edges, element)
-
-    contours, _ = cv2.findContours(
-        edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
-
-    max_area = 0
-    largest_contour = None
-    for contour in contours:
-      area = cv2.contourArea(contour)
-      if area > max_area:
-        max_area = area
-        largest_contour = contour
-
-    if largest_contour is not None:
-      bounding_rect = cv2.boundingRect(largest_contour)
-      x = bounding_rect[0] + bounding_rect[2] / 2
-      y = bounding_rect[1] + bounding_rect[3] / 2
-
-      cv2.drawContours(im, [largest_contour], -1, (255, 128, 128), 1)
-      cv2.rectangle(im,
-                    (bounding_rect[0], bounding_rect[1]),
-                    (bounding_rect[0] + bounding_rect[2],
-                     bounding_rect[1] + bounding_rect[3]),
-                    (255, 255, 255))
-      cv2.circle(im, (x,y), 2, (0, 0, 255))
-
-      return (x, y)
-    else:
-      return None
+  def SetDetector(self, detector):
+    logger.info('using %s', detector.__class__.__name__)
+    detector.Reset()
+    self._detector = detector
+    if self._predictor is not None:
+      self._predictor.Reset()
+
+  def _FindQuad(self, im, canvas=None):
+    return self._detector.Detect(im, canvas)
 
   def Step(self):
     self._capture.grab()
-    result, im = self._capture.retrieve()
+    timestamp = time.time() - self._capture_latency
+    result, im = self._frames.Retrieve(self._capture)
+
+    # annotations go on a copy so the capture buffer is never written
+    canvas = None
+    if im is not None and self._display:
+      canvas = self._scratch.Canvas('display', im)
 
     if im is not None:
-      position = self._FindQuad(im)
+      position = self._FindQuad(im, canvas)
     else:
       position = None
     if position is not None:
+      self._latency = time.time() - timestamp
+      if self._predictor is not None:
+        position = self._predictor.Update(position, timestamp)
       x, y = position
       roll = self._x_pid.Update(x)
       pitch = self._y_pid.Update(y)
-      logger.debug('video pos: (%d, %d)  roll: %f  pitch: %f  auto: %d',
-                   x, y, roll, pitch, self._auto)
-      cv2.putText(im, 'roll: %f' % roll, (2, 20),
-                  cv2.FONT_HERSHEY_PLAIN, 1.0, (0, 0, 0))
-      cv2.putText(im, 'pitch: %f' % pitch, (2, 40),
-                  cv2.FONT_HERSHEY_PLAIN, 1.0, (0, 0, 0))
+      logger.debug('video pos: (%.1f, %.1f)  roll: %f  pitch: %f  auto: %d  '
+                   'latency: %.1fms', x, y, roll, pitch, self._auto,
+                   self._latency * 1000.0)
+      if canvas is not None:
+        cv2.putText(canvas, 'roll: %f' % roll, (2, 20),
+                    cv2.FONT_HERSHEY_PLAIN, 1.0, (0, 0, 0))
+        cv2.putText(canvas, 'pitch: %f' % pitch, (2, 40),
+                    cv2.FONT_HERSHEY_PLAIN, 1.0, (0, 0, 0))
+        cv2.putText(canvas, 'latency: %.1fms' % (self._latency * 1000.0), (2, 60),
+                    cv2.FONT_HERSHEY_PLAIN, 1.0, (0, 0, 0))
     else:
       roll = 0
       pitch = 0
@@ -93,9 +116,21 @@ class VideoPIDController(object):
       self._cfmonitor.SetRoll(roll)
       self._cfmonitor.SetPitch(pitch)
 
-    if im is not None:
-      cv2.circle(im, (int(self._x_target), int(self._y_target)), 2, (0, 255, 0))
-      cv2.imshow(self._window_name, im)
+    if canvas is not None:
+      cv2.circle(canvas, (int(self._x_target), int(self._y_target)), 2,
+                 (0, 255, 0))
+      cv2.imshow(self._window_name, canvas)
+      key = cv2.waitKey(1) & 0xff
+      if key == ord('d'):
+        self._NextDetector()
+
+  def _NextDetector(self):
+    # cycle through quad_detector.DETECTORS with default options
+    names = sorted(quad_detector.DETECTORS)
+    current = [name for name in names
+               if isinstance(self._detector, quad_detector.DETECTORS[name])]
+    index = names.index(current[0]) + 1 if current else 0
+    self.SetDetector(quad_detector.CreateDetector(names[index % len(names)]))
 
   def SetAuto(self, auto):
     self._auto = auto
@@ -103,7 +138,7 @@ class VideoPIDController(object):
 
 if __name__ == '__main__':
   im = cv2.imread('/home/mattgruskin/Pictures/Webcam/2013-08-12-103637.jpg')
-  v = VideoPIDController(None)
-  v._FindQuad(im)
+  v = VideoPIDController(None, create_windows=False)
+  v._FindQuad(im, im)
   cv2.imshow(v._window_name, im)
   cv2.waitKey()
@@ -0,0 +1,355 @@
+import heapq
+import logging
+import math
+import random
+import threading
+import time
+import urlparse
+
+logger = logging.getLogger('virtual_link')
+
+URI_SCHEME = 'virtual://'
+
+# physics of the simulated craft, loosely matched to a Crazyflie
+HOVER_THRUST = 40000
+CLIMB_RATE = 0.0001     # m/s per unit of thrust above hover
+PRESSURE_GROUND = 1000.0
+PRESSURE_PER_METER = 0.12
+YAW_RATE = 1.0          # deg/s per unit of commanded yaw
+MAG_FIELD = 200
+
+
+def IsVirtualUri(link_uri):
+  return link_uri.startswith(URI_SCHEME)
+
+
+class Caller(object):
+  """Stand-in for cflib.utils.callbacks.Caller."""
+  def __init__(self):
+    self._callbacks = []
+
+  def add_callback(self, cb):
+    if cb not in self._callbacks:
+      self._callbacks.append(cb)
+
+  def remove_callback(self, cb):
+    self._callbacks.remove(cb)
+
+  def call(self, *args):
+    for cb in self._callbacks:
+      cb(*args)
+
+
+class LogVariable(object):
+  """Stand-in for cfclient.utils.logconfigreader.LogVariable."""
+  def __init__(self, name='', fetchAs='uint8_t'):
+    self._name = name
+    self._fetch_as = fetchAs
+
+  def getName(self):
+    return self._name
+
+
+class LogConfig(object):
+  """Stand-in for cfclient.utils.logconfigreader.LogConfig."""
+  def __init__(self, configname, period=0):
+    self._name = configname
+    self._period = period
+    self._variables = []
+
+  def addVariable(self, var):
+    self._variables.append(var)
+
+  def getVariables(self):
+    return self._variables
+
+  def getPeriod(self):
+    return self._period
+
+
+class Scheduler(object):
+  """Single thread delivering timed events for every virtual craft.
+
+  One thread for all craft keeps hundreds of them cheap, and makes the
+  dispatch lag (how late events run) a direct measure of how well the
+  callbacks on the monitor side keep up.
+  """
+  def __init__(self):
+    self._cond = threading.Condition()
+    self._queue = []
+    self._seq = 0
+    self._thread = None
+    self._running = True
+    self.dispatched = 0
+    self.total_lag = 0.0
+    self.max_lag = 0.0
+
+  def Schedule(self, delay, fn, *args):
+    with self._cond:
+      self._seq += 1
+      heapq.heappush(self._queue, (time.time() + delay, self._seq, fn, args))
+      self._cond.notify()
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._Run,
+                                        name='virtual_link')
+        self._thread.daemon = True
+        self._thread.start()
+
+  def Stop(self):
+    with self._cond:
+      self._running = False
+      self._cond.notify()
+    if self._thread is not None:
+      self._thread.join()
+
+  def _Run(self):
+    while True:
+      with self._cond:
+        while True:
+          if not self._running:
+            return
+          now = time.time()
+          if self._queue and self._queue[0][0] <= now:
+            due, _, fn, args = heapq.heappop(self._queue)
+            break
+          timeout = self._queue[0][0] - now if self._queue else None
+          self._cond.wait(timeout)
+      lag = now - due
+      self.dispatched += 1
+      self.total_lag += lag
+      self.max_lag = max(self.max_lag, lag)
+      try:
+        fn(*args)
+      except Exception:
+        logger.exception('Virtual link callback failed')
+
+  def ResetStats(self):
+    self.dispatched = 0
+    self.total_lag = 0.0
+    self.max_lag = 0.0
+
+
+_scheduler = Scheduler()
+
+def GetScheduler():
+  return _scheduler
+
+
+class _Log(object):
+  def __init__(self, cf):
+    self._cf = cf
+
+  def create_log_packet(self, logconf):
+    return _LogPacket(self._cf, logconf)
+
+
+class _LogPacket(object):
+  def __init__(self, cf, logconf):
+    self._cf = cf
+    self._names = [v.getName() for v in logconf.getVariables()]
+    if cf._packet_rate:
+      self._period = 1.0 / cf._packet_rate
+    else:
+      self._period = logconf.getPeriod() / 1000.0
+    self._running = False
+    self.dataReceived = Caller()
+
+  def start(self):
+    self._running = True
+    _scheduler.Schedule(self._period, self._Send)
+
+  def stop(self):
+    self._running = False
+
+  def _Send(self):
+    if not self._running or not self._cf._open:
+      return
+    _scheduler.Schedule(self._period, self._Send)
+    data = self._cf._Sample(self._names)
+    self._cf._Transmit(self.dataReceived.call, data)
+
+
+class _Commander(object):
+  def __init__(self, cf):
+    self._cf = cf
+
+  def send_setpoint(self, roll, pitch, yaw, thrust):
+    self._cf.setpoints_sent += 1
+    self._cf._Transmit(self._cf._OnSetpoint, roll, pitch, yaw, thrust)
+
+
+class VirtualCrazyflie(object):
+  """Implements the parts of cflib.crazyflie.Crazyflie CfMonitor uses.
+
+  Link behaviour comes from the URI query, e.g.
+  virtual://3?rate=100&loss=0.05&latency=0.02&jitter=0.005
+    rate     log packets per second (default: the log config period)
+    loss     probability each packet, in either direction, is dropped
+    latency  one-way delay in seconds
+    jitter   standard deviation added to latency
+  """
+  def __init__(self):
+    self.connectSetupFinished = Caller()
+    self.log = _Log(self)
+    self.commander = _Commander(self)
+    self._open = False
+    self._packet_rate = None
+    self._loss = 0.0
+    self._latency = 0.0
+    self._jitter = 0.0
+    self._random = random.Random()
+
+    self._altitude = 0.0
+    self._heading = 0.0
+    self._thrust = 0
+    self._yaw = 0.0
+    self._last_sim_time = time.time()
+
+    self.setpoints_sent = 0
+    self.setpoints_received = 0
+    self.packets_sent = 0
+    self.packets_dropped = 0
+
+  def open_link(self, link_uri):
+    query = urlparse.parse_qs(urlparse.urlsplit(link_uri).query)
+    if 'rate' in query:
+      self._packet_rate = float(query['rate'][0])
+    self._loss = float(query.get('loss', [0.0])[0])
+    self._latency = float(query.get('latency', [0.0])[0])
+    self._jitter = float(query.get('jitter', [0.0])[0])
+    self._random.seed(link_uri)
+    self._open = True
+    _scheduler.Schedule(self._latency, self.connectSetupFinished.call,
+                        link_uri)
+
+  def close_link(self):
+    self._open = False
+
+  def _Transmit(self, fn, *args):
+    self.packets_sent += 1
+    if self._random.random() < self._loss:
+      self.packets_dropped += 1
+      return
+    delay = self._latency
+    if self._jitter:
+      delay = max(0.0, self._random.gauss(delay, self._jitter))
+    _scheduler.Schedule(delay, fn, *args)
+
+  def _OnSetpoint(self, roll, pitch, yaw, thrust):
+    self._Simulate()
+    self.setpoints_received += 1
+    self._thrust = thrust
+    self._yaw = yaw
+
+  def _Simulate(self):
+    now = time.time()
+    dt = now - self._last_sim_time
+    self._last_sim_time = now
+    if self._thrust > 0 or self._altitude > 0:
+      self._altitude += (self._thrust - HOVER_THRUST) * CLIMB_RATE * dt
+      self._altitude = max(0.0, self._altitude)
+    self._heading += self._yaw * YAW_RATE * dt
+
+  def _Sample(self, names):
+    self._Simulate()
+    heading = math.radians(self._heading)
+    values = {
+        'stabilizer.thrust': self._thrust,
+        'altimeter.pressure':
+            PRESSURE_GROUND - self._altitude * PRESSURE_PER_METER,
+        'mag.x': int(MAG_FIELD * math.cos(heading)),
+        'mag.y': int(MAG_FIELD * math.sin(heading)),
+        'mag.z': 0,
+        'acc.x': 0.0,
+        'acc.y': 0.0,
+        'acc.z': 1.0,
+    }
+    return dict((name, values.get(name, 0)) for name in names)
+
+
+if __name__ == '__main__':
+  # load test: run many virtual craft through CfMonitor and report how
+  # the monitor and controllers keep up
+  import argparse
+  import compass_yaw_controller
+  import monitor
+  # the module monitor uses, not this __main__ copy
+  import virtual_link
+  scheduler = virtual_link.GetScheduler()
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--count', type=int, default=100)
+  parser.add_argument('--rate', type=float, default=10.0,
+                      help='log packets per second per craft')
+  parser.add_argument('--loss', type=float, default=0.0)
+  parser.add_argument('--latency', type=float, default=0.01)
+  parser.add_argument('--jitter', type=float, default=0.0)
+  parser.add_argument('--loop-rate', type=float, default=60.0)
+  parser.add_argument('--duration', type=float, default=10.0)
+  parser.add_argument('--window', action='store_true',
+                      help='also feed a CfMonitorWindow table')
+  args = parser.parse_args()
+
+  logging.basicConfig(
+      level=logging.WARNING,
+      format='%(asctime)s %(levelname).1s %(module)-12.12s %(message)s')
+
+  window = None
+  if args.window:
+    import sys
+    import monitor_window
+    from PyQt4 import QtGui
+    app = QtGui.QApplication(sys.argv)
+    window = monitor_window.CfMonitorWindow(args.count)
+
+  cfmonitors = []
+  controllers = []
+  for i in xrange(args.count):
+    uri = '%s%d?rate=%f&loss=%f&latency=%f&jitter=%f' % (
+        URI_SCHEME, i, args.rate, args.loss, args.latency, args.jitter)
+    cfmonitor = monitor.CfMonitor(i, uri, window)
+    cfmonitor.SetThrust(HOVER_THRUST)
+    cfmonitors.append(cfmonitor)
+    controller = compass_yaw_controller.CompassYawController(
+        cfmonitor, create_windows=False)
+    controller.SetAuto(True)
+    controllers.append(controller)
+
+  period = 1.0 / args.loop_rate
+  loops = 0
+  overruns = 0
+  start = time.time()
+  cpu_start = time.clock()
+  while time.time() - start < args.duration:
+    loop_start = time.time()
+    for controller in controllers:
+      controller.Step()
+    for cfmonitor in cfmonitors:
+      cfmonitor.UpdateCommander()
+    if window is not None:
+      app.processEvents()
+    loops += 1
+    remaining = period - (time.time() - loop_start)
+    if remaining > 0:
+      time.sleep(remaining)
+    else:
+      overruns += 1
+  elapsed = time.time() - start
+  cpu = time.clock() - cpu_start
+
+  craft = [cfmonitor._cf for cfmonitor in cfmonitors]
+  packets_sent = sum(cf.packets_sent for cf in craft)
+  packets_dropped = sum(cf.packets_dropped for cf in craft)
+  setpoints_received = sum(cf.setpoints_received for cf in craft)
+  print '%d craft, %.1fs: loop %.1f Hz (target %.1f, %d overruns), cpu %.0f%%' % (
+      args.count, elapsed, loops / elapsed, args.loop_rate, overruns,
+      100.0 * cpu / elapsed)
+  print 'packets: %d sent, %d dropped, %d setpoints received' % (
+      packets_sent, packets_dropped, setpoints_received)
+  print 'dispatch: %d events, mean lag %.2fms, max lag %.2fms' % (
+      scheduler.dispatched,
+      1000.0 * scheduler.total_lag / max(1, scheduler.dispatched),
+      1000.0 * scheduler.max_lag)
+  for cfmonitor in cfmonitors:
+    cfmonitor.Shutdown()
+  scheduler.Stop()